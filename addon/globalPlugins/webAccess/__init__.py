@@ -63,6 +63,7 @@ import imp
 import re
 import sys
 import time
+import weakref
 import wx
 
 import addonHandler
@@ -91,6 +92,7 @@ from . import nodeHandler
 from . import presenter
 from . import webAppLib
 from .webAppLib import *
+from . import webAppScheduler
 from .webAppScheduler import WebAppScheduler
 from . import webModuleHandler
 from .webModuleHandler import webModule
@@ -112,6 +114,17 @@ useInternalBrowser = False
 webAccessEnabled = True
 scheduler = None
 
+config.conf.spec["webAccess"] = {
+	# The ceiling, in seconds, of the delay before polling for changes while idle.
+	"maxPollInterval": "float(default=%s, min=%s)" % (
+		webAppScheduler.POLL_INTERVAL_MAX, webAppScheduler.POLL_INTERVAL_MIN
+	),
+}
+
+#: The web module matching the URL of each document, see L{getDocumentWebApp}.
+#: Maps each tree interceptor to the URL of its document and its web module.
+documentWebApps = weakref.WeakKeyDictionary()
+
 def getEssai ():
 	obj = api.getFocusObject ()
 	focus = obj.treeInterceptor
@@ -171,7 +184,10 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 	def __init__(self):
 		super(globalPluginHandler.GlobalPlugin, self).__init__()
 		global scheduler
-		scheduler = WebAppScheduler(onNodeManagerUpdated)
+		scheduler = WebAppScheduler(
+			onNodeManagerUpdated,
+			maxPollInterval=config.conf["webAccess"]["maxPollInterval"]
+		)
 		scheduler.start ()
 		
 		baseObject.ScriptableObject.getWebApp = getWebApp
@@ -251,6 +267,17 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		msg = u"nodeManager %d caractères, %s, %s" % (treeInterceptor.nodeManager.treeInterceptorSize, treeInterceptor.nodeManager.isReady, treeInterceptor.nodeManager.mainNode is not None)
 		speech.speakMessage (msg)
 		allMsg += msg + "\r\n"
+		nodeCount, charCount = nodeHandler.registry.getMemoryUsage ()
+		msg = u"%d nodeManagers en cache, %d nœuds, %d caractères" % (len(nodeHandler.registry.entries), nodeCount, charCount)
+		speech.speakMessage (msg)
+		allMsg += msg + "\r\n"
+		stats = scheduler.queue.getStats ()
+		msg = u"scheduler %d événements en attente (maximum %d), %d fusionnés, latence moyenne %d ms, maximale %d ms" % (
+			stats["depth"], stats["maxDepth"], stats["coalesced"],
+			stats["averageLatency"] * 1000, stats["maxLatency"] * 1000
+		)
+		speech.speakMessage (msg)
+		allMsg += msg + "\r\n"
 		api.copyToClip (allMsg)
 		 
 	def script_toggleWebAccessSupport(self, gesture):
@@ -307,10 +334,10 @@ def getWebApp(self, eventName=None):
 
 	# Before anything, check if the webApp window title matches the actuel one.
 	if len(obj.windowText) > 0:
-		for app in webModuleHandler.getWebModules():
-			if app.windowTitle is not None and len(app.windowTitle) > 0 and app.windowTitle in obj.windowText:
-				webApp = app
-				break
+		webApp = webModuleHandler.getWebModuleFromWindowTitle(obj.windowText)
+
+	treeInterceptor = getattr(obj, "treeInterceptor", None)
+	rootObj = treeInterceptor.rootNVDAObject if treeInterceptor is not None else None
 
 	i = 0
 	while webApp is None and obj is not None and i < 30:
@@ -327,13 +354,18 @@ def getWebApp(self, eventName=None):
 			webApp = wa
 			break
 		
-		# On HTML webApps, we extract the URL from the document IAccessible value.
-		try:
-			url = obj.IAccessibleObject.accValue(obj.IAccessibleChildID)
-		except: 
-			url = None
-		if url:
-			webApp = getWebAppFromUrl(url)
+		# Objects are created anew on each event: the web module of the root
+		# document is cached, while nearer frames are looked up each time.
+		if rootObj is not None and obj == rootObj:
+			webApp = getDocumentWebApp(treeInterceptor)
+		else:
+			# On HTML webApps, we extract the URL from the document IAccessible value.
+			try:
+				url = obj.IAccessibleObject.accValue(obj.IAccessibleChildID)
+			except: 
+				url = None
+			if url:
+				webApp = getWebAppFromUrl(url)
 
 		obj= obj.parent
 
@@ -350,6 +382,35 @@ def getWebApp(self, eventName=None):
 	# sendWebAppEvent('webApp_checkPendingActions', self, webApp)
 	# sendWebAppEvent('webApp_pageChanged', wPageTitle, activeWebApp)
 
+def getDocumentUrl(treeInterceptor):
+	obj = treeInterceptor.rootNVDAObject
+	try:
+		return obj.IAccessibleObject.accValue(obj.IAccessibleChildID)
+	except:
+		return None
+
+def getDocumentWebApp(treeInterceptor):
+	"""Returns the web module matching the URL of the root document of a tree interceptor.
+	
+	Once the document is ready, the result is kept until the document is
+	reloaded, its URL changes or the web modules are refreshed.
+	Only the root document is considered: the URL of a frame or a link
+	found by climbing the ancestors of an object never gets cached.
+	"""
+	entry = documentWebApps.get(treeInterceptor)
+	if entry is None:
+		url = getDocumentUrl(treeInterceptor)
+		if not treeInterceptor.isReady:
+			return getWebAppFromUrl(url) if url else None
+		entry = documentWebApps[treeInterceptor] = (url, getWebAppFromUrl(url) if url else None)
+	return entry[1]
+
+def checkDocumentWebApp(treeInterceptor):
+	"""Forgets the web module resolved for a document if its URL changed."""
+	entry = documentWebApps.get(treeInterceptor)
+	if entry is not None and getDocumentUrl(treeInterceptor) != entry[0]:
+		documentWebApps.pop(treeInterceptor, None)
+
 def onNodeManagerUpdated (nodeManager):
 	global activeWebApp
 
@@ -359,6 +420,7 @@ def onNodeManagerUpdated (nodeManager):
 		webApp.widgetManager.update ()
 
 def _loadBufferDone(self, success=True):
+	documentWebApps.pop(self, None)
 	self._loadProgressCallLater.Stop()
 	#self.essai2 = getEssai ()
 	del self._loadProgressCallLater
@@ -556,34 +618,19 @@ def getWebAppFromObject(obj, eventName):
 	# log.info("Searching for object webapp eventName = %s" % eventName)
 	if eventName not in ("gainFocus", "becomeNavigatorObject"):
 		return None
-	for app in webModuleHandler.getWebModules():
+	for app in webModuleHandler.getClaimingWebModules():
 		# log.info("object class is %s" % obj.__class__)
-		if hasattr(app, "claimObjectClasses"):
-			for cls in obj.__class__.__mro__:
-				if cls in app.claimObjectClasses:
-					log.info("app %s can claim for object %s" %(app.name, str(obj.__class__)))
-					if app.claimForJABObject(obj) is True:
-						return app
+		for cls in obj.__class__.__mro__:
+			if cls in app.claimObjectClasses:
+				log.info("app %s can claim for object %s" %(app.name, str(obj.__class__)))
+				if app.claimForJABObject(obj) is True:
+					return app
 	return None
 
 def getWebAppFromUrl(url):
 	if url is None:
 		return None
-	matchedLen = 0
-	matchedWebApp = None
-	for webApp in webModuleHandler.getWebModules():
-		if webApp.url is None:
-			continue
-		if isinstance(webApp.url, tuple) or isinstance(webApp.url, list):
-			urls = webApp.url
-		else:
-			urls = [webApp.url]
-		for wUrl in urls:
-			if wUrl in url and len(wUrl) > matchedLen:
-				# log.info("Webapp candidate url %s, len %d" % (wUrl, len(wUrl)))
-				matchedWebApp = webApp
-				matchedLen = len(wUrl)
-	return matchedWebApp
+	return webModuleHandler.getWebModuleFromUrl(url)
 
 def setFocusToWebApp(srcApp, webAppName):
 	global activeWebApp
@@ -591,10 +638,10 @@ def setFocusToWebApp(srcApp, webAppName):
 	if activeWebApp == srcApp:
 		log.info("Posting setFocus event to ourself is not allowed.")
 		return True
-	for app in webModuleHandler.getWebModules():
-		if app.name == webAppName:
-			sendWebAppEvent('event_webApp_setFocus', srcApp, app)
-			return True
+	app = webModuleHandler.getWebModuleByName(webAppName)
+	if app is not None:
+		sendWebAppEvent('event_webApp_setFocus', srcApp, app)
+		return True
 	log.info("Set focus to webApp %s failed: Application not found.", webAppName)
 	return False
 
@@ -24,12 +24,17 @@ __version__ = "2017.03.22"
 __author__ = u"Frédéric Brugnot <f.brugnot@accessolutions.fr>, Julien Cochuyt <j.cochuyt@accessolutions.fr>"
 
 
+import bisect
+import collections
+import itertools
 import Queue
+import re
 import time
 import weakref
 import winUser
 import wx
 import XMLFormatting
+import zlib
 
 import api
 import baseObject
@@ -40,6 +45,7 @@ import threading
 import ui
 
 from .webAppLib import *
+from . import vbufParser
 
 
 REASON_FOCUS = 0
@@ -47,20 +53,378 @@ REASON_NAVIGATION = 1
 REASON_SHORTCUT = 2
 _count = 0
 
+#: Above this ratio of changed fields, incremental update falls back to a full rebuild.
+INCREMENTAL_MAX_CHANGE_RATIO = 0.5
+
+#: Count and size of the evenly spaced text samples hashed by L{NodeManager.getContentSignature}.
+CHANGE_SAMPLE_COUNT = 64
+CHANGE_SAMPLE_SIZE = 512
+
+#: Up to this size, the whole text is hashed, as it is no larger than the samples.
+CHANGE_FULL_HASH_MAX_SIZE = CHANGE_SAMPLE_COUNT * CHANGE_SAMPLE_SIZE
+
+#: Bounds of L{NodeManagerRegistry}: count of node managers, total count of
+#: nodes and of characters, and delay in seconds after which the tree of a
+#: tree interceptor which has not been updated is released.
+REGISTRY_MAX_COUNT = 10
+REGISTRY_MAX_NODES = 500000
+REGISTRY_MAX_CHARACTERS = 5000000
+REGISTRY_MAX_IDLE = 600
+
+#: Traversal orders for L{NodeManager.iterNodes}
+ORDER_PREORDER = "preorder"
+ORDER_POSTORDER = "postorder"
+
+#: Node attributes maintained in L{NodeTree.attributeIndex}.
+INDEXED_ATTRIBUTES = ("role", "tag", "id", "className", "src")
+
+#: Above this ratio of candidate nodes, searchNode walks the whole tree instead.
+INDEX_MAX_CANDIDATE_RATIO = 0.25
+
+#: Above this count of substrings, an in_ criterion is matched with a regular expression.
+SUBSTRING_REGEX_THRESHOLD = 3
+
+
+def limitResults(results, limit=None, nth=None):
+	"""Consumes only the needed part of a lazy sequence of search results.
+	@param limit: The maximum count of results, C{None} for all.
+	@param nth: If set, only the result at this position (starting at 1) is kept.
+	@rtype list
+	"""
+	if nth is not None:
+		return list(itertools.islice(results, nth - 1, nth))
+	if limit is not None:
+		return list(itertools.islice(results, limit))
+	return list(results)
+
+
+def fieldEquals(field1, field2):
+	"""Compares two items of a C{getTextWithFields} list."""
+	if field1 is field2:
+		return True
+	if isinstance(field1, unicode) or isinstance(field2, unicode):
+		return field1 == field2
+	if field1.command != field2.command:
+		return False
+	if field1.command == "controlStart" and (
+		field1.field.get("controlIdentifier_ID")
+		!= field2.field.get("controlIdentifier_ID")
+	):
+		return False
+	return field1.field == field2.field
+
+
+class IncrementalUpdate(object):
+	"""Describes which nodes of the previous tree can be reused.
+	
+	The previous and new field lists share a common prefix and a common suffix.
+	A node entirely contained in one of those is reused: it is copied into
+	the new tree, its offsets and field indexes being shifted if it lies in
+	the suffix.
+	"""
+	
+	def __init__(self, nodesByFieldIndex, prefixLen, suffixStart, indexShift):
+		self.nodesByFieldIndex = nodesByFieldIndex
+		self.prefixLen = prefixLen
+		self.suffixStart = suffixStart
+		self.indexShift = indexShift
+
+	def getNode(self, fieldIndex):
+		if fieldIndex < self.prefixLen:
+			node = self.nodesByFieldIndex.get(fieldIndex)
+			if node is not None and node._fieldEnd < self.prefixLen:
+				return node
+		elif fieldIndex >= self.suffixStart:
+			return self.nodesByFieldIndex.get(fieldIndex - self.indexShift)
+		return None
+
+
+class NodeTree(object):
+	"""A tree built by L{NodeManager}, along with its indexes.
+	
+	Each update builds a new tree aside, which is then published at once,
+	so that readers never see a tree being built.
+	Once published, a tree is never modified: an incremental update copies
+	the nodes it reuses.
+	"""
+	
+	def __init__(self, info=None, fieldList=None):
+		self.identifier = None
+		self.info = info
+		self.fieldList = fieldList
+		self.mainNode = None
+		self.nodesByFieldIndex = {}
+		#: Attribute -> value -> nodes, for each of L{INDEXED_ATTRIBUTES}.
+		self.attributeIndex = dict((attr, {}) for attr in INDEXED_ATTRIBUTES)
+		#: Non-empty text nodes, in document order.
+		self.textNodes = []
+		self.textNodeOffsets = []
+		# The text of all the text nodes, see getText.
+		self.text = None
+
+	def indexTextNode(self, node):
+		# Empty text nodes cannot contain any offset.
+		if node.size > 0:
+			self.textNodes.append(node)
+			self.textNodeOffsets.append(node.offset)
+
+	def indexNode(self, node):
+		index = self.attributeIndex
+		index["role"].setdefault(node.role, []).append(node)
+		index["tag"].setdefault(node.tag, []).append(node)
+		index["id"].setdefault(node.id, []).append(node)
+		index["src"].setdefault(node.src, []).append(node)
+		for token in set(node.className.split()):
+			index["className"].setdefault(token, []).append(node)
+
+	def getIndexedNodes(self, attr, values):
+		"""Returns a superset of the nodes whose attribute equals one of the values."""
+		index = self.attributeIndex[attr]
+		nodes = set()
+		for value in values:
+			if attr != "className":
+				nodes.update(index.get(value, ()))
+				continue
+			tokens = value.split()
+			if not tokens:
+				# Unindexed, let the caller walk the tree.
+				return None
+			tokenNodes = set(index.get(tokens[0], ()))
+			for token in tokens[1:]:
+				tokenNodes.intersection_update(index.get(token, ()))
+			nodes.update(tokenNodes)
+		return nodes
+
+	def getSearchCandidates(self, criteria):
+		"""Narrows a searchNode query using the attribute index.
+		
+		As criteria satisfied by an ancestor are not checked again on its
+		descendants, every result lies within the subtree of a node satisfying
+		any given criterion.
+		The smallest indexed set of such nodes is thus a valid starting point.
+		@returns The candidate subtree roots, or C{None} if the whole tree should be walked.
+		@rtype set
+		"""
+		candidates = None
+		for key, attr, values in criteria.eq:
+			if attr not in INDEXED_ATTRIBUTES:
+				continue
+			nodes = self.getIndexedNodes(attr, values)
+			if nodes is not None and (candidates is None or len(nodes) < len(candidates)):
+				candidates = nodes
+		if candidates is not None and len(candidates) > len(self.nodesByFieldIndex) * INDEX_MAX_CANDIDATE_RATIO:
+			return None
+		return candidates
+
+	def getMemoryUsage(self):
+		"""
+		@returns The count of nodes and of characters of this tree.
+		@rtype tuple
+		"""
+		if self.mainNode is None:
+			return 0, 0
+		return len(self.nodesByFieldIndex) + len(self.textNodes), self.mainNode.size
+
+	def getText(self):
+		"""Returns the text of the whole tree.
+		
+		Offsets of the text nodes are their positions in this text.
+		"""
+		if self.text is None:
+			self.text = u"".join([node.text for node in self.textNodes])
+		return self.text
+
+	def searchText(self, node, needles):
+		"""Returns the text nodes of a subtree containing any of the needles.
+		
+		Rather than testing each text node, the needles are searched within
+		the text of the subtree as a whole. Each occurrence is then mapped
+		to the text node it starts in, and kept only if it also ends there.
+		@param node: The root of the subtree, a node of this tree.
+		@returns The text nodes found, in document order, or C{None} if
+			the index cannot be used and the subtree has to be walked.
+		@rtype list of NodeField
+		"""
+		for needle in needles:
+			# The empty string would also match empty text nodes, which are not indexed.
+			if not needle:
+				return None
+		text = self.getText()
+		offsets = self.textNodeOffsets
+		textNodes = self.textNodes
+		start = bisect.bisect_left(offsets, node.offset)
+		end = bisect.bisect_left(offsets, node.offset + node.size)
+		if start == end:
+			return []
+		endOffset = node.offset + node.size
+		found = set()
+		for needle in needles:
+			size = len(needle)
+			pos = offsets[start]
+			while True:
+				pos = text.find(needle, pos, endOffset)
+				if pos < 0:
+					break
+				index = bisect.bisect_right(offsets, pos, start, end) - 1
+				textNode = textNodes[index]
+				nodeEnd = textNode.offset + textNode.size
+				if pos + size <= nodeEnd:
+					found.add(index)
+				# Any further occurrence starting in the same text node is either
+				# already accounted for or spans beyond it.
+				pos = nodeEnd
+		return [textNodes[index] for index in sorted(found)]
+
+	def searchOffset(self, offset):
+		# Text nodes are indexed in document order, thus sorted by offset.
+		index = bisect.bisect_right(self.textNodeOffsets, offset) - 1
+		if index < 0:
+			return None
+		node = self.textNodes[index]
+		if offset < node.offset + node.size:
+			return node
+		return None
+
+
+class SubtreeSet(object):
+	"""A set of subtrees, telling in logarithmic time whether a node lies within one of them.
+	
+	Subtrees are identified by their root nodes. A node lies within the
+	subtree of a root if it is the root itself or one of its descendants.
+	All the nodes should belong to the same tree.
+	"""
+	
+	def __init__(self, roots):
+		self.roots = []
+		# Field ranges of the roots, sorted and disjoint.
+		self.starts = []
+		self.ends = []
+		for node in sorted(roots, key=lambda node: node._fieldStart):
+			if self.ends and node._fieldEnd <= self.ends[-1]:
+				# Nested within the previous root
+				continue
+			self.roots.append(node)
+			self.starts.append(node._fieldStart)
+			self.ends.append(node._fieldEnd)
+
+	def __contains__(self, node):
+		index = bisect.bisect_right(self.starts, node._fieldStart) - 1
+		return index >= 0 and node._fieldEnd <= self.ends[index]
+
+	def __len__(self):
+		return len(self.roots)
+
+
+class NodeManagerRegistry(object):
+	"""Keeps the node managers of the tree interceptors, most recently used last.
+	
+	The trees of the least recently used tree interceptors are released as
+	soon as the count of node managers, of nodes or of characters exceeds
+	its bound, or once they have not been used for a while.
+	Tree interceptors which are not alive anymore are dropped.
+	"""
+	
+	def __init__(
+		self,
+		maxCount=REGISTRY_MAX_COUNT,
+		maxNodes=REGISTRY_MAX_NODES,
+		maxCharacters=REGISTRY_MAX_CHARACTERS,
+		maxIdle=REGISTRY_MAX_IDLE
+	):
+		self.maxCount = maxCount
+		self.maxNodes = maxNodes
+		self.maxCharacters = maxCharacters
+		self.maxIdle = maxIdle
+		self.lock = threading.RLock()
+		# treeInterceptor -> (nodeManager, time of last use)
+		self.entries = collections.OrderedDict()
+		self.evictedCount = 0
+
+	def get(self, treeInterceptor):
+		"""Returns the node manager of a tree interceptor, marking it as most recently used.
+		@rtype NodeManager
+		"""
+		with self.lock:
+			entry = self.entries.pop(treeInterceptor, None)
+			if entry is None:
+				return None
+			nodeManager = entry[0]
+			self.entries[treeInterceptor] = (nodeManager, time.time())
+			return nodeManager
+
+	def add(self, treeInterceptor, nodeManager):
+		with self.lock:
+			self.entries.pop(treeInterceptor, None)
+			self.entries[treeInterceptor] = (nodeManager, time.time())
+			treeInterceptor.nodeManager = nodeManager
+
+	def getMemoryUsage(self):
+		"""
+		@returns The total count of nodes and of characters of the registered trees.
+		@rtype tuple
+		"""
+		nodeCount = charCount = 0
+		with self.lock:
+			for nodeManager, lastUse in self.entries.itervalues():
+				nodes, chars = nodeManager.tree.getMemoryUsage()
+				nodeCount += nodes
+				charCount += chars
+		return nodeCount, charCount
+
+	def purge(self):
+		"""Releases the trees exceeding the bounds, the least recently used first.
+		
+		The most recently used one is always kept.
+		"""
+		with self.lock:
+			now = time.time()
+			for treeInterceptor, (nodeManager, lastUse) in self.entries.items()[:-1]:
+				if not getattr(treeInterceptor, "isAlive", True) or now - lastUse > self.maxIdle:
+					self.evict(treeInterceptor)
+			nodeCount, charCount = self.getMemoryUsage()
+			while len(self.entries) > 1 and (
+				len(self.entries) > self.maxCount
+				or nodeCount > self.maxNodes
+				or charCount > self.maxCharacters
+			):
+				treeInterceptor = next(iter(self.entries))
+				nodes, chars = self.entries[treeInterceptor][0].tree.getMemoryUsage()
+				nodeCount -= nodes
+				charCount -= chars
+				self.evict(treeInterceptor)
+
+	def evict(self, treeInterceptor):
+		with self.lock:
+			nodeManager, lastUse = self.entries.pop(treeInterceptor)
+			if getattr(treeInterceptor, "nodeManager", None) is nodeManager:
+				del treeInterceptor.nodeManager
+			nodeManager.release()
+			self.evictedCount += 1
+
+
+#: The node managers of all the tree interceptors.
+registry = NodeManagerRegistry()
+
 
 class NodeManager(baseObject.ScriptableObject):
 	
+	#: Parse the virtual buffer XML directly rather than using getTextWithFields.
+	useVBufParser = True
+
 	def __init__(self, treeInterceptor, callbackNodeMoveto=None, inSeparateThread=False):
 		super(NodeManager, self).__init__()
 		#log.info (u"nodeManager created")
 		self._ready = False
-		self.identifier = None 
+		self.tree = NodeTree()
+		# The tree being built, not yet published
+		self.newTree = None
 		if treeInterceptor is None:
 			log.info (u"nodeManager called with none treeInterceptor")
 			return
 		self.treeInterceptor = treeInterceptor
 		self.treeInterceptorSize = 0
-		self.mainNode = None
+		self.contentSignature = None
+		self.incrementalUpdate = None
 		self.devNode = None
 		self.callbackNodeMoveto = callbackNodeMoveto
 		self.updating = False
@@ -82,97 +446,313 @@ class NodeManager(baseObject.ScriptableObject):
 		if not self.treeInterceptor or not self.treeInterceptor.isReady:
 			self._ready = False
 			return False
-		try:
-			info = self.treeInterceptor.makeTextInfo(textInfos.POSITION_LAST)
-		except:
-			self._ready = False
-			return False
-		try:
-			size = info._endOffset+1
-		except:
+		signature = self.getContentSignature()
+		if signature is None:
 			self._ready = False
 			return False
-		if size == self.treeInterceptorSize:
-			# probably not changed
+		if signature == self.contentSignature:
+			# not changed
 			return False
-		self.treeInterceptorSize = size
 		try:
 			self.updating = True
 			info = self.treeInterceptor.makeTextInfo(textInfos.POSITION_ALL)
-			fields = info.getTextWithFields()
+			fields = self.getTextWithFields(info)
 		except:
 			self.updating = False
 			self._ready = False
 			log.info (u"getTextWithFields error")
 			return False
-		self.info = info
-		self.fieldList = fields
+		tree = self.newTree = NodeTree(info, fields)
+		self.incrementalUpdate = self.getIncrementalUpdate(fields)
 		self.fieldIndex = 0
 		self.fieldOffset = 0
 		self.lastTextNode = None 
-		self.mainNode = self.createNodeField (None)
-		if self.mainNode is None:
+		tree.mainNode = self.createNodeField (None)
+		self.newTree = None
+		self.incrementalUpdate = None
+		if tree.mainNode is None:
 			self.updating = False
 			self._ready = False
 			return False
 		self.devNode = None
-		self.identifier = time.time()
+		tree.identifier = time.time()
+		# Only kept once built: a failed build is retried on the next poll.
+		self.contentSignature = signature
+		self.treeInterceptorSize = signature[0]
+		# Readers see either the previous tree or this one, never a mix of both.
+		self.tree = tree
 		#logTime ("Update node manager %d nodes" % len(fields), t)
 		self.updating = False
 		#playWebAppSound ("tick")
 		self._curNode = self.caretNode = self.getCaretNode()
+		# The signature was computed before retrieving the fields: should the
+		# content have changed during the build, the next poll catches it.
+		self._ready = True
+		from . import webAppScheduler
+		webAppScheduler.scheduler.send (eventName="nodeManagerUpdated", nodeManager=self)
+		return True
+
+	def getContentSignature(self):
+		"""Computes a cheap signature of the text of the tree interceptor.
+		
+		The size of the document is combined with a rolling hash of
+		L{CHANGE_SAMPLE_COUNT} evenly spaced samples of its text, or of the
+		whole text if it is no larger than the samples.
+		This costs a bounded amount of text whatever the size of the
+		document, and catches the changes within the samples that do not
+		alter the size, such as a counter going from 10 to 11.
+		
+		Only the text is considered: changes of attributes or of structure
+		alone, as well as changes not altering the size outside of the
+		samples of a large document, go unnoticed until another change.
+		@returns The size and the hash, or C{None} if the content is not available.
+		@rtype tuple
+		"""
 		try:
 			info = self.treeInterceptor.makeTextInfo(textInfos.POSITION_LAST)
+			size = info._endOffset+1
+			if size <= CHANGE_FULL_HASH_MAX_SIZE:
+				crc = zlib.crc32(self.getText(0, size).encode("utf-8"))
+			else:
+				crc = 0
+				step = size // CHANGE_SAMPLE_COUNT
+				for index in xrange(CHANGE_SAMPLE_COUNT):
+					start = index * step
+					text = self.getText(start, min(start + CHANGE_SAMPLE_SIZE, size))
+					crc = zlib.crc32(text.encode("utf-8"), crc)
 		except:
-			self._ready = False
-			return False
-		size = info._endOffset+1
-		from . import webAppScheduler
-		if size != self.treeInterceptorSize:
-			# treeInterceptor has changed during analyze
-			self._ready = False
-			webAppScheduler.scheduler.send (eventName="updateNodeManager", treeInterceptor=self.treeInterceptor)
-			return False
-		else:
-			self._ready = True
-			webAppScheduler.scheduler.send (eventName="nodeManagerUpdated", nodeManager=self)
-			return True
-		return False
+			return None
+		return size, crc
+
+	def getText(self, start, end):
+		"""Returns the plain text of the tree interceptor between two offsets."""
+		if hasattr(self.treeInterceptor, "VBufHandle"):
+			return NVDAHelper.VBuf_getTextInRange(self.treeInterceptor.VBufHandle, start, end, False) or u""
+		info = self.treeInterceptor.makeTextInfo(textInfos.offsets.Offsets(start, end))
+		return info.text
+
+	def getTextWithFields(self, info):
+		if self.useVBufParser and hasattr(self.treeInterceptor, "VBufHandle"):
+			try:
+				return vbufParser.getTextWithFields(info)
+			except:
+				log.exception(u"Virtual buffer parsing error")
+		return info.getTextWithFields()
 
 	def _get_isReady (self):
 		if not self._ready or not self.treeInterceptor or not self.treeInterceptor.isReady:
 			return False
 		return True
 
-	def createNodeField(self, parent):
-		if self.fieldIndex >= len(self.fieldList):
+	def release(self):
+		"""Drops the tree and detaches from the tree interceptor.
+		
+		Holders of this node manager then see it as not ready.
+		"""
+		self._ready = False
+		self.tree = NodeTree()
+		self.contentSignature = None
+		self.treeInterceptorSize = 0
+		self.treeInterceptor = None
+
+	def _get_identifier (self):
+		return self.tree.identifier
+
+	def _get_info (self):
+		return self.tree.info
+
+	def _get_fieldList (self):
+		return self.tree.fieldList
+
+	def _get_mainNode (self):
+		return self.tree.mainNode
+
+	def getIncrementalUpdate(self, fields):
+		"""Diffs the new field list against the one the current tree was built from.
+		@returns The nodes which can be reused, or C{None} if a full rebuild is needed.
+		@rtype IncrementalUpdate
+		"""
+		tree = self.tree
+		oldFields = tree.fieldList
+		if tree.mainNode is None or not oldFields:
 			return None
-		f = self.fieldList[self.fieldIndex]
-		if isinstance (f, unicode):
-			node = NodeField (f, parent, self.fieldOffset, self)
-			self.fieldOffset += node.size
-			self.lastTextNode = node
-			return node
-		elif f.command == "controlEnd":
+		oldLen = len(oldFields)
+		newLen = len(fields)
+		maxLen = min(oldLen, newLen)
+		prefixLen = 0
+		while prefixLen < maxLen and fieldEquals(oldFields[prefixLen], fields[prefixLen]):
+			prefixLen += 1
+		suffixLen = 0
+		maxLen -= prefixLen
+		while suffixLen < maxLen and fieldEquals(
+			oldFields[oldLen - suffixLen - 1], fields[newLen - suffixLen - 1]
+		):
+			suffixLen += 1
+		changed = (oldLen - prefixLen - suffixLen) + (newLen - prefixLen - suffixLen)
+		if changed > newLen * INCREMENTAL_MAX_CHANGE_RATIO:
 			return None
-		elif f.command == "formatChange":
-			return NodeField(f, parent, self.fieldOffset, self)
-		elif f.command == "controlStart":
-			node = NodeField(f, parent, self.fieldOffset, self)
+		return IncrementalUpdate(
+			tree.nodesByFieldIndex,
+			prefixLen,
+			newLen - suffixLen,
+			newLen - oldLen
+		)
+
+	def reuseNodeField(self, parent):
+		"""Copies an unchanged subtree of the previous tree at the current field.
+		
+		The previous tree may still be in use: its nodes are copied rather
+		than moved, which remains much cheaper than creating them from the fields.
+		@returns The copied node, or C{None} if it has to be created.
+		@rtype NodeField
+		"""
+		if self.incrementalUpdate is None:
+			return None
+		node = self.incrementalUpdate.getNode(self.fieldIndex)
+		if node is None:
+			return None
+		tree = self.newTree
+		indexShift = self.fieldIndex - node._fieldStart
+		offsetShift = self.fieldOffset - node.offset
+		node = node.copy(parent)
+		lastTextNode = self.lastTextNode
+		stack = [node]
+		while stack:
+			n = stack.pop()
+			n.offset += offsetShift
+			n._fieldStart += indexShift
+			n._fieldEnd += indexShift
+			if hasattr(n, "text"):
+				lastTextNode = n
+				tree.indexTextNode(n)
+			elif hasattr(n, "children"):
+				n.previousTextNode = lastTextNode
+				n.children = [child.copy(n) for child in n.children]
+				tree.nodesByFieldIndex[n._fieldStart] = n
+				tree.indexNode(n)
+				stack.extend(reversed(n.children))
+		self.lastTextNode = lastTextNode
+		self.fieldOffset += node.size
+		self.fieldIndex = node._fieldEnd
+		return node
+
+	def searchCandidates(self, candidates, criteria, tree=None):
+		"""Runs searchNode on each candidate subtree, in document order.
+		
+		Criteria consumed by ancestors are replayed first, so that the results
+		are the same as those of a search from the main node.
+		@param tree: The tree of the candidates, whose text index then serves text criteria.
+		@type tree: L{NodeTree}
+		"""
+		return list(self.iterSearchCandidates(candidates, criteria, tree))
+
+	def iterSearchCandidates(self, candidates, criteria, tree=None):
+		"""Lazy version of L{searchCandidates}."""
+		# Remaining criteria once a node has been visited, None if excluded
+		remainingByNode = {}
+		lastNode = None
+		for node in sorted(candidates, key=lambda n: n._fieldStart):
+			if lastNode is not None and node._fieldStart <= lastNode._fieldEnd:
+				# Already searched within the previous candidate subtree
+				continue
+			lastNode = node
+			ancestors = []
+			parent = node.parent
+			while parent is not None and parent not in remainingByNode:
+				ancestors.append(parent)
+				parent = parent.parent
+			remaining = criteria.keys if parent is None else remainingByNode[parent]
+			for ancestor in reversed(ancestors):
+				# A search does not go below an excluded node nor below a result.
+				if remaining is not None and (remaining or ancestor.parent is None):
+					remaining = criteria.match(ancestor, remaining)
+				remainingByNode[ancestor] = remaining
+			if remaining is None:
+				continue
+			if remaining or node.parent is None:
+				for result in node.iterSearchCriteria(criteria, remaining, tree):
+					yield result
+			elif criteria.text != []:
+				# An ancestor is a result: its text nodes within this subtree are results too.
+				for result in node.searchString(criteria.text, tree):
+					yield result
+
+	def createNodeField(self, parent):
+		"""Creates the node starting at the current field, along with its descendants.
+		
+		Control nodes still open are kept on an explicit stack rather than
+		on the call stack, so that deeply nested documents do not hit the
+		recursion limit.
+		On return, fieldIndex is left on the last field of the created node.
+		@returns The created node, or C{None} at the end of a control or of the field list.
+		@rtype NodeField
+		"""
+		tree = self.newTree
+		fieldList = tree.fieldList
+		fieldCount = len(fieldList)
+		stack = []
+		while True:
+			if self.fieldIndex >= fieldCount:
+				f = None
+			else:
+				f = fieldList[self.fieldIndex]
+			if f is None or (not isinstance (f, unicode) and f.command == "controlEnd"):
+				if not stack:
+					return None
+				node = stack.pop()
+				node._fieldEnd = self.fieldIndex
+			elif isinstance (f, unicode):
+				node = NodeField (f, stack[-1] if stack else parent, self.fieldOffset, self)
+				node._fieldStart = node._fieldEnd = self.fieldIndex
+				self.fieldOffset += node.size
+				self.lastTextNode = node
+				tree.indexTextNode(node)
+			elif f.command == "formatChange":
+				node = NodeField(f, stack[-1] if stack else parent, self.fieldOffset, self)
+				node._fieldStart = node._fieldEnd = self.fieldIndex
+			elif f.command == "controlStart":
+				node = self.reuseNodeField(stack[-1] if stack else parent)
+				if node is None:
+					node = NodeField(f, stack[-1] if stack else parent, self.fieldOffset, self)
+					node._fieldStart = self.fieldIndex
+					tree.nodesByFieldIndex[node._fieldStart] = node
+					tree.indexNode(node)
+					stack.append(node)
+					self.fieldIndex += 1
+					continue
+			else:
+				raise ValueError("Unexpected field command: %s" % f.command)
+			if not stack:
+				return node
+			stack[-1].children.append(node)
+			stack[-1].size += node.size
 			self.fieldIndex += 1
-			chield = self.createNodeField (node)
-			while chield is not None:
-				node.children.append(chield)
-				node.size += chield.size
-				self.fieldIndex += 1
-				chield = self.createNodeField(node)
-			return node
-		raise
 	
 	def searchString(self, text):
 		if not self.isReady:
 			return []
-		return self.mainNode.searchString (text)
+		tree = self.tree
+		return tree.mainNode.searchString (text, tree)
+
+	def ancestors(self, node):
+		"""Returns the ancestors of a node, its parent first."""
+		ancestors = []
+		node = node.parent
+		while node is not None:
+			ancestors.append(node)
+			node = node.parent
+		return ancestors
+
+	def iterNodes(self, order=ORDER_PREORDER):
+		"""Iterates over the nodes of the tree.
+		
+		The traversal is lazy: the caller may stop as soon as it found what
+		it was looking for.
+		@param order: L{ORDER_PREORDER} (document order) or L{ORDER_POSTORDER}
+		"""
+		if not self.isReady:
+			return iter(())
+		return self.mainNode.iterNodes(order)
 
 	def searchSimple(self, **kwargs):
 		if not self.isReady:
@@ -184,21 +764,106 @@ class NodeManager(baseObject.ScriptableObject):
 		#logTime (u"simple %d node %s " % (_count, kwargs), t)
 		return r
 
-	def searchNode(self, **kwargs):
+	def searchNode(self, limit=None, nth=None, **kwargs):
+		"""
+		@param limit: The maximum count of results, C{None} for all.
+		@param nth: If set, only the result at this position (starting at 1) is returned.
+		"""
+		return self.searchCriteria(SearchCriteria(kwargs), limit=limit, nth=nth)
+
+	def searchCriteria(self, criteria, limit=None, nth=None, scope=None, excludeScope=False):
+		"""Runs a search, stopping the walk as soon as the requested results are found.
+		
+		See L{searchNode} for the meaning of C{limit} and C{nth}, and
+		L{iterSearchCriteria} for the meaning of C{scope} and C{excludeScope}.
+		"""
 		if not self.isReady:
 			return []
 		t = logTimeStart ()
 		global _count 
 		_count = 0
-		r = self.mainNode.searchNode (**kwargs)
-		#logTime (u"search %d node %s " % (_count, kwargs), t)
+		r = limitResults(
+			self.iterSearchCriteria(criteria, scope=scope, excludeScope=excludeScope),
+			limit=limit,
+			nth=nth
+		)
+		#logTime (u"search %d node %s " % (_count, criteria.kwargs), t)
 		return r
 
+	def iterSearchCriteria(self, criteria, scope=None, excludeScope=False):
+		"""Lazily yields the results of a search, in document order.
+		
+		@param scope: If set, only the results lying within these subtrees
+			are yielded, or only those lying outside of them if C{excludeScope}
+			is set. The results are the same as those of the whole tree they
+			keep.
+		@type scope: L{SubtreeSet}
+		"""
+		if not self.isReady:
+			return iter(())
+		tree = self.tree
+		candidates = tree.getSearchCandidates(criteria)
+		if scope is None:
+			if candidates is None:
+				return tree.mainNode.iterSearchCriteria (criteria, tree=tree)
+			return self.iterSearchCandidates(candidates, criteria, tree)
+		if excludeScope:
+			if candidates is None:
+				results = tree.mainNode.iterSearchCriteria (criteria, tree=tree)
+			else:
+				results = self.iterSearchCandidates(candidates, criteria, tree)
+			return (node for node in results if node not in scope)
+		if candidates is None or len(candidates) > len(scope):
+			# Only the subtrees of the scope need to be walked.
+			candidates = scope.roots
+		return (
+			node for node in self.iterSearchCandidates(candidates, criteria, tree)
+			if node in scope
+		)
+
+	def searchNodes(self, criteriaList, limits=None):
+		"""Runs several searches at once.
+		
+		Searches narrowed by the attribute index are run on their candidate
+		subtrees, the others are evaluated together in a single walk of the tree.
+		@param criteriaList: The criteria of each search.
+		@type criteriaList: list of L{SearchCriteria}
+		@param limits: The maximum count of results of each search, C{None} for all.
+		@type limits: list
+		@returns The list of results of each search.
+		@rtype list of list of NodeField
+		"""
+		if not self.isReady:
+			return [[] for criteria in criteriaList]
+		if limits is None:
+			limits = [None] * len(criteriaList)
+		tree = self.tree
+		results = [None] * len(criteriaList)
+		batch = []
+		for index, criteria in enumerate(criteriaList):
+			candidates = tree.getSearchCandidates(criteria)
+			if candidates is not None:
+				results[index] = limitResults(
+					self.iterSearchCandidates(candidates, criteria, tree),
+					limit=limits[index]
+				)
+			else:
+				batch.append(index)
+		if batch:
+			multiSearch = MultiSearch(
+				[criteriaList[index] for index in batch],
+				[limits[index] for index in batch]
+			)
+			for index, nodeList in zip(batch, multiSearch.run(tree.mainNode, tree)):
+				results[index] = nodeList
+		return results
+
 	def searchOffset (self, offset):
 		if not self.isReady:
 			return None
-		node = self.devNode if self.devNode else self.mainNode
-		return node.searchOffset (offset)
+		if self.devNode:
+			return self.devNode.searchOffset (offset)
+		return self.tree.searchOffset (offset)
 	
 	def getCaretNode(self):
 		"""
@@ -287,15 +952,241 @@ class NodeManager(baseObject.ScriptableObject):
 		"kb:uparrow": "previousItem",
 		"kb:enter": "enter",
 		}
-class NodeField (baseObject.AutoPropertyObject):
-	customText = ""
+class SearchCriteria(object):
+	"""Compiled form of the L{NodeField.searchNode} keyword arguments.
+	
+	Equality criteria are turned into frozensets and substring criteria into
+	wildcard-stripped substrings, or a single regular expression when there
+	are many of them.
+	The positive criteria a node still has to satisfy are identified by their
+	keyword argument name.
+	"""
+	
+	def __init__(self, kwargs):
+		self.kwargs = kwargs
+		# [(key, attr, frozenset)]
+		self.eq = []
+		# [(key, attr, matcher)]
+		self.in_ = []
+		# [(attr, frozenset)]
+		self.notEq = []
+		# [(attr, matcher)]
+		self.notIn = []
+		self.text = kwargs.get("eq_text", [])
+		self.prevText = kwargs.get("prev_text", "")
+		keys = set()
+		for key, values in kwargs.iteritems():
+			if not isinstance(values, list):
+				values = [values]
+			# Control nodes have no text: text criteria other than eq_text never match.
+			if key[:3] == "eq_" and key != "eq_text":
+				keys.add(key)
+				self.eq.append((key, key[3:], frozenset(values)))
+			elif key[:3] == "in_" and key != "in_text":
+				keys.add(key)
+				self.in_.append((key, key[3:], self.compileSubstrings(values)))
+			elif key[:6] == "notEq_" and key != "notEq_text":
+				self.notEq.append((key[6:], frozenset(values)))
+			elif key[:6] == "notIn_" and key != "notIn_text":
+				self.notIn.append((key[6:], self.compileSubstrings(values)))
+		self.keys = frozenset(keys)
+
+	@staticmethod
+	def compileSubstrings(values):
+		"""Returns a function checking whether a value contains any of the wildcard-stripped values."""
+		substrings = [value.replace("*", "") for value in values]
+		if len(substrings) > SUBSTRING_REGEX_THRESHOLD:
+			search = re.compile(u"|".join(re.escape(substring) for substring in substrings)).search
+			return lambda value: bool(value) and search(value) is not None
+		def match(value):
+			if value is None or value == "":
+				return False
+			for substring in substrings:
+				if substring in value:
+					return True
+			return False
+		return match
+
+	def match(self, node, remaining):
+		"""Checks a control node against the criteria.
+		@param remaining: The positive criteria not yet satisfied by an ancestor.
+		@type remaining: frozenset
+		@returns C{None} if the node is excluded by a negative criterion,
+			the positive criteria it leaves unsatisfied otherwise.
+		@rtype frozenset
+		"""
+		for attr, values in self.notEq:
+			if getattr(node, attr, None) in values:
+				return None
+		for attr, match in self.notIn:
+			if match(getattr(node, attr, None)):
+				return None
+		satisfied = None
+		for key, attr, values in self.eq:
+			if key in remaining and getattr(node, attr, None) in values:
+				if satisfied is None:
+					satisfied = set()
+				satisfied.add(key)
+		for key, attr, match in self.in_:
+			if key in remaining and match(getattr(node, attr, None)):
+				if satisfied is None:
+					satisfied = set()
+				satisfied.add(key)
+		if satisfied is None:
+			return remaining
+		return remaining.difference(satisfied)
+
+
+class MultiSearch(object):
+	"""Evaluates several searches in a single walk of the tree.
+	
+	Equality criteria of all searches are merged into dispatch tables keyed
+	by attribute value, so that each node costs one lookup per attribute in
+	use rather than one evaluation per search.
+	The state of each search along the current path is the set of its
+	positive criteria not yet satisfied by an ancestor, as in
+	L{NodeField.searchCriteria}.
+	Searches having reached their limit are dropped from the walk, which
+	stops as soon as none remains.
+	"""
+	
+	def __init__(self, criteriaList, limits=None):
+		self.criteriaList = criteriaList
+		self.limits = limits if limits is not None else [None] * len(criteriaList)
+		# attr -> value -> [(search index, key)]
+		self.eqDispatch = {}
+		# attr -> value -> [search index]
+		self.notEqDispatch = {}
+		# [(search index, key, attr, matcher)]
+		self.inCriteria = []
+		# [(search index, attr, matcher)]
+		self.notInCriteria = []
+		# Searches without positive criteria are satisfied by the main node
+		self.unconditional = []
+		self.initialState = {}
+		for index, criteria in enumerate(criteriaList):
+			for key, attr, values in criteria.eq:
+				dispatch = self.eqDispatch.setdefault(attr, {})
+				for value in values:
+					dispatch.setdefault(value, []).append((index, key))
+			for key, attr, match in criteria.in_:
+				self.inCriteria.append((index, key, attr, match))
+			for attr, values in criteria.notEq:
+				dispatch = self.notEqDispatch.setdefault(attr, {})
+				for value in values:
+					dispatch.setdefault(value, []).append(index)
+			for attr, match in criteria.notIn:
+				self.notInCriteria.append((index, attr, match))
+			if criteria.keys:
+				self.initialState[index] = criteria.keys
+			else:
+				self.unconditional.append(index)
+
+	def run(self, mainNode, tree=None):
+		"""Walks the tree once.
+		@param tree: The tree of the main node, whose text index then serves text criteria.
+		@type tree: L{NodeTree}
+		@returns The list of results of each search.
+		@rtype list of list of NodeField
+		"""
+		limits = self.limits
+		results = [[] for criteria in self.criteriaList]
+		for index in self.unconditional:
+			results[index] = limitResults(
+				mainNode.iterSearchCriteria(self.criteriaList[index], tree=tree),
+				limit=limits[index]
+			)
+		# Searches having reached their limit
+		done = set()
+		pending = len(self.initialState)
+		stack = [(mainNode, self.initialState)]
+		while stack and pending:
+			node, state = stack.pop()
+			if done and not done.isdisjoint(state):
+				state = dict(
+					(index, keys)
+					for index, keys in state.iteritems()
+					if index not in done
+				)
+			if not state or not hasattr(node, "children"):
+				continue
+			excluded = set()
+			for attr, dispatch in self.notEqDispatch.iteritems():
+				excluded.update(dispatch.get(getattr(node, attr, None), ()))
+			for index, attr, match in self.notInCriteria:
+				if index in state and match(getattr(node, attr, None)):
+					excluded.add(index)
+			satisfied = {}
+			for attr, dispatch in self.eqDispatch.iteritems():
+				for index, key in dispatch.get(getattr(node, attr, None), ()):
+					if index in state:
+						satisfied.setdefault(index, set()).add(key)
+			for index, key, attr, match in self.inCriteria:
+				if (
+					index in state
+					and key in state[index]
+					and match(getattr(node, attr, None))
+				):
+					satisfied.setdefault(index, set()).add(key)
+			if excluded or satisfied:
+				state = state.copy()
+				for index in excluded:
+					state.pop(index, None)
+				for index, keys in satisfied.iteritems():
+					if index in excluded:
+						continue
+					remaining = state[index].difference(keys)
+					if remaining:
+						state[index] = remaining
+					else:
+						del state[index]
+						nodeList = results[index]
+						nodeList.extend(node.getFoundResults(self.criteriaList[index], tree))
+						limit = limits[index]
+						if limit is not None and len(nodeList) >= limit:
+							del nodeList[limit:]
+							done.add(index)
+							pending -= 1
+			if state:
+				stack.extend((child, state) for child in reversed(node.children))
+		return results
+
+
+# Creates a node without initializing it, see L{NodeField.copy}.
+_newNodeField = object.__new__
+
+
+class NodeField (object):
+	"""A node of the tree built by L{NodeManager}.
+	
+	Text nodes have a C{text} attribute, control nodes a C{control} attribute
+	and C{children}, format nodes a C{format} attribute.
+	Attributes not relevant to a kind of node are left unset, so that
+	C{hasattr} tells them apart.
+	As pages may hold tens of thousands of nodes, slots are used rather than
+	a per-instance dictionary.
+	
+	Each node spans the indexes of its first and last fields in the field
+	list, C{_fieldStart} and C{_fieldEnd}: these number the entry in and
+	exit from each node in a depth-first walk of the tree, thus telling
+	ancestors apart in constant time (see L{isAncestorOf}).
+	"""
+	
+	__slots__ = (
+		"nodeManager", "parent", "offset", "size",
+		"text", "customText", "format", "control", "children",
+		"name", "role", "controlIdentifier", "previousTextNode",
+		"tag", "id", "className", "src",
+		"_fieldStart", "_fieldEnd", "_innerText",
+		"__weakref__",
+	)
 	
 	def __init__(self, field, parent, offset, nodeManager):
-		super(NodeField, self).__init__()
 		self.nodeManager = nodeManager
 		self.parent = parent
 		self.offset = offset
 		self.size = 0
+		self.customText = ""
 		if isinstance (field, unicode):
 			self.size = len(field)
 			self.text = field
@@ -306,17 +1197,6 @@ class NodeField (baseObject.AutoPropertyObject):
 			self.format = field.field
 		elif field.command == "controlStart":
 			self.control = field.field
-			# jklm
-			#info = self.nodeManager.treeInterceptor.makeTextInfo(textInfos.offsets.Offsets(self.offset, self.offset))
-			info = self.nodeManager.info
-			obj = info.obj
-			try:
-				doc = info.obj.rootNVDAObject.HTMLNode.document
-				n = self.nodeManager.treeInterceptor.essai2 if hasattr (self.nodeManager.treeInterceptor, "essai2") else "non"
-				#log.info (u"n%s : %s" % (self.control.get ("controlIdentifier_ID", ""), n))
-			except:
-				pass
-			
 			self.name = self.control.get("name", "")
 			self.role = self.control["role"]
 			self.previousTextNode = nodeManager.lastTextNode
@@ -338,6 +1218,35 @@ class NodeField (baseObject.AutoPropertyObject):
 				self.src = self.control["HTMLAttrib::src"] if "HTMLAttrib::src" in self.control else ""
 			self.children = []
 
+	def copy (self, parent):
+		"""Returns a copy of this node attached to another parent, sharing its children list."""
+		node = _newNodeField (NodeField)
+		node.nodeManager = self.nodeManager
+		node.parent = parent
+		node.offset = self.offset
+		node.size = self.size
+		node.customText = self.customText
+		if hasattr (self, "text"):
+			node.text = self.text
+			node.controlIdentifier = self.controlIdentifier
+			node.role = self.role
+		elif hasattr (self, "control"):
+			node.control = self.control
+			node.children = self.children
+			node.name = self.name
+			node.role = self.role
+			node.controlIdentifier = self.controlIdentifier
+			node.previousTextNode = self.previousTextNode
+			node.tag = self.tag
+			node.id = self.id
+			node.className = self.className
+			node.src = self.src
+		else:
+			node.format = self.format
+		node._fieldStart = self._fieldStart
+		node._fieldEnd = self._fieldEnd
+		return node
+
 	def __repr__ (self):
 		if hasattr (self, "text"):
 			return u"Node text : %s" % self.text
@@ -348,20 +1257,53 @@ class NodeField (baseObject.AutoPropertyObject):
 		else:
 			return u"Node unknown"
 		
-	def searchString (self, text):
+	def iterNodes (self, order=ORDER_PREORDER):
+		"""Iterates over this node and its descendants.
+		@param order: L{ORDER_PREORDER} (document order) or L{ORDER_POSTORDER}
+		"""
+		if order == ORDER_PREORDER:
+			stack = [self]
+			while stack:
+				node = stack.pop()
+				yield node
+				if hasattr (node, "children"):
+					stack.extend (reversed (node.children))
+		elif order == ORDER_POSTORDER:
+			# Nodes are pushed a second time, with a flag, once their children are.
+			stack = [(self, False)]
+			while stack:
+				node, expanded = stack.pop()
+				if expanded or not hasattr (node, "children"):
+					yield node
+					continue
+				stack.append ((node, True))
+				stack.extend ((child, False) for child in reversed (node.children))
+		else:
+			raise ValueError ("Unknown order: %s" % order)
+
+	def searchString (self, text, tree=None):
+		"""Returns the text nodes of this subtree containing any of the given strings.
+		@param tree: The tree of this node, if its text index is to be used.
+		@type tree: L{NodeTree}
+		"""
 		if not isinstance (text, list):
 			text = [text]
-		if hasattr (self, "text"):
-			for t in text:
-				if t in self.text:
-					return [self]
-			return []
-		elif hasattr (self, "children"):
-			result = []
-			for chield in self.children:
-				result += chield.searchString (text)
-			return result
-		return []
+		if tree is not None:
+			result = tree.searchText (self, text)
+			if result is not None:
+				return result
+		result = []
+		stack = [self]
+		while stack:
+			node = stack.pop()
+			if hasattr (node, "text"):
+				for t in text:
+					if t in node.text:
+						result.append (node)
+						break
+			elif hasattr (node, "children"):
+				stack.extend (reversed (node.children))
+		return result
 
 	def search_eq (self, itemList, value):
 		if not isinstance (itemList, list):
@@ -393,54 +1335,67 @@ class NodeField (baseObject.AutoPropertyObject):
 		return nodeList
 
 	def searchNode (self, **kwargs):
+		return self.searchCriteria (SearchCriteria (kwargs))
+
+	def searchCriteria (self, criteria, remaining=None, tree=None):
+		"""Searches this subtree.
+		@param remaining: The positive criteria not yet satisfied by an ancestor.
+		@type remaining: frozenset
+		@param tree: The tree of this node, if its text index is to be used.
+		@type tree: L{NodeTree}
+		"""
+		return list (self.iterSearchCriteria (criteria, remaining, tree))
+
+	def iterSearchCriteria (self, criteria, remaining=None, tree=None):
+		"""Lazy version of L{searchCriteria}, yielding results in document order."""
 		global _count
-		_count += 1
-		nodeList = []
-		if hasattr (self, "control"):
-			found = True
-			for key in kwargs.keys(): 
-				if key[:3] == "eq_": 
-					if self.search_eq (kwargs[key], getattr (self, key[3:], None)):
-						del kwargs[key]
-					elif key != "eq_text":
-						found = False
-				if key[:3] == "in_": 
-					if self.search_in (kwargs[key], getattr (self, key[3:], None)):
-						del kwargs[key]
-					elif key != "in_text":
-						found = False
-				if key[:6] == "notEq_": 
-					if self.search_eq (kwargs[key], getattr (self, key[6:], None)):
-						return []
-				if key[:6] == "notIn_": 
-					if self.search_in (kwargs[key], getattr (self, key[6:], None)):
-						return []
-			if found:
-				text = kwargs.get ("eq_text", []) 
-				prevText = kwargs.get ("prev_text", "") 
-				if text != []:
-					return self.searchString (text)
-				elif prevText != "":
-					if self.previousTextNode is not None and prevText in self.previousTextNode.text:
-						return [self]
-					else:
-						return []
-				else:
-					return [self]
-			for child in self.children:
-				nodeList += child.searchNode (**kwargs)
-		return nodeList
+		if remaining is None:
+			remaining = criteria.keys
+		stack = [(self, remaining)]
+		while stack:
+			node, remaining = stack.pop()
+			_count += 1
+			if not hasattr (node, "control"):
+				continue
+			remaining = criteria.match (node, remaining)
+			if remaining is None:
+				continue
+			if not remaining:
+				for result in node.getFoundResults (criteria, tree):
+					yield result
+				continue
+			stack.extend ((child, remaining) for child in reversed (node.children))
+
+	def getFoundResults (self, criteria, tree=None):
+		"""Returns the search results for this node, all its criteria being satisfied."""
+		text = criteria.text
+		prevText = criteria.prevText
+		if text != []:
+			return self.searchString (text, tree)
+		elif prevText != "":
+			if self.previousTextNode is not None and prevText in self.previousTextNode.text:
+				return [self]
+			else:
+				return []
+		else:
+			return [self]
 
 	def searchOffset (self, offset):
-		if hasattr (self, "text"):
-			if offset >= self.offset and offset < self.offset + self.size: 
-				return self
-		elif hasattr (self, "children"):
-			for chield in self.children:
-				node = chield.searchOffset (offset)
-				if node:
-					return node
-		return None
+		node = self
+		while True:
+			if not (offset >= node.offset and offset < node.offset + node.size):
+				return None
+			if hasattr (node, "text"):
+				return node
+			if not hasattr (node, "children"):
+				return None
+			# Children are contiguous: only one of them may contain the offset.
+			for child in node.children:
+				if offset < child.offset + child.size:
+					node = child
+					break
+			else:
+				return None
 	
 	def firstTextNode(self):
 		return self.searchOffset(self.offset)
@@ -523,6 +1478,13 @@ class NodeField (baseObject.AutoPropertyObject):
 			return True
 		return False
 
+	def isAncestorOf(self, node):
+		"""Tells in constant time whether a node lies within the subtree of this one.
+		
+		Both nodes should belong to the same tree.
+		"""
+		return self._fieldStart < node._fieldStart and node._fieldEnd <= self._fieldEnd
+
 	def __contains__(self, node):
 		if self == node:
 			return True
@@ -536,23 +1498,33 @@ class NodeField (baseObject.AutoPropertyObject):
 		return self.size
 	
 	def _get_innerText (self):
-		txt = ""
-		if hasattr (self, "text"):
-			txt = self.text
-			try:
-				txt = self.customText
-			except:
-				pass
-		log.info("Txt is %s" % txt)
-		if len(txt) > 0:
-			if not txt.endswith('\n'):
-				txt += " "
-			return txt
- 		if hasattr (self, "children"):
-			for child in self.children:
-				txt += child._get_innerText()
-			return txt
-		return ""
+		"""The text of this subtree, each text node followed by a space unless ending a line.
+		
+		As a tree is never modified once published, the result is kept on
+		each node it is computed for, and reused by the ancestors.
+		"""
+		innerText = getattr (self, "_innerText", None)
+		if innerText is not None:
+			return innerText
+		txtList = []
+		stack = [self]
+		while stack:
+			node = stack.pop()
+			innerText = getattr (node, "_innerText", None)
+			if innerText is not None:
+				txtList.append (innerText)
+				continue
+			txt = node.customText if hasattr (node, "text") else ""
+			if len(txt) > 0:
+				if not txt.endswith('\n'):
+					txt += " "
+				txtList.append (txt)
+			elif hasattr (node, "children"):
+				stack.extend (reversed (node.children))
+		innerText = self._innerText = "".join (txtList)
+		return innerText
+
+	innerText = property(_get_innerText)
 
 	def getTextInfo (self):
 		if not self.nodeManager.isReady:
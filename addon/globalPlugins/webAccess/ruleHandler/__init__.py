@@ -29,6 +29,7 @@ import addonHandler
 addonHandler.initTranslation()
 import api
 import baseObject
+import bisect
 import browseMode
 import controlTypes
 import gui
@@ -92,14 +93,34 @@ class MarkerGenericCollection(genericCollection.GenericCollection):
 
 	@classmethod
 	def getInstanceList(cls, webApp, nodeManager):
+		"""Creates an instance per query of the current page with results.
+		
+		The instance of a query whose results did not change since the
+		previous call (see C{MarkerManager.changedQueries}) is kept, along
+		with its state, and only gets its nodes from the new tree.
+		"""
+		markerManager = webApp.markerManager
+		with markerManager.lock:
+			changedQueries = markerManager.changedQueries
+			markerManager.changedQueries = set()
+		previousInstances = dict(
+			(instance._query, instance)
+			for instance in webApp.widgetManager.widgets.get(cls, [])
+		)
+		activeQueries = set(markerManager.getActiveQueries())
 		instanceList = []
-		for query in webApp.markerManager.markerQueries:
-			if query.createWidget:
+		for query in markerManager.markerQueries:
+			if query.createWidget and query in activeQueries:
 				resultList = query.getResults(widget=True)
 				nodeList = [] 
 				for result in resultList:
 					nodeList.append(result.node)
 				if len(nodeList) > 0:
+					instance = previousInstances.get(query)
+					if instance is not None and query not in changedQueries:
+						instance.setCollection(nodeList)
+						instanceList.append(instance)
+						continue
 					instance = MarkerGenericCollection(webApp)
 					instance._collection = nodeList
 					instance._query = query
@@ -114,6 +135,12 @@ class MarkerGenericCollection(genericCollection.GenericCollection):
 		super(MarkerGenericCollection, self).__init__(webApp)
 		self.autoEnter = False
 
+	def setCollection(self, nodeList):
+		"""Replaces the nodes of an unchanged collection by those of the new tree."""
+		self._collection = nodeList
+		if self.activeNode is not None and self.itemIndex < len(nodeList):
+			self.activeNode = nodeList[self.itemIndex]
+
 class DefaultMarkerScripts(baseObject.ScriptableObject):
 	
 	def __init__(self, warningMessage):
@@ -142,14 +169,37 @@ class MarkerManager(baseObject.ScriptableObject):
 		self.markerQueries = []
 		self.lock = threading.RLock()
 		self.markerResults = []
+		self.resultsIndex = MarkerResultsIndex([])
+		# Gesture dispatch tables, built on demand, see getMarkerScript
+		self._resultsGestureDispatch = None
+		self._queriesGestureDispatch = None
+		# Queries in context order, by page identifier, see getQueriesByPage
+		self._queriesByPage = None
+		# Queries bound to a page, in context order, see getPageQueries
+		self._pageBoundQueries = []
+		#: The page identified by the last update, see resolvePageIdentifier.
+		self.pageIdentifier = None
+		# Changes made by the last update, see MarkerResultMatcher
+		self.addedResults = []
+		self.removedResults = []
+		self.movedResults = []
+		# Added results not yet checked for auto actions
+		self.autoActionCandidates = []
+		# Queries whose results changed, not yet refreshed by the widgets
+		self.changedQueries = set()
+		self.resultMatcher = None
 		self.pendingMoveto = None 
-		self.triggeredIdentifiers = []
+		self.triggeredIdentifiers = set()
 		self.defaultMarkerScripts = DefaultMarkerScripts(u"Aucun marqueur associé à cette touche")
 		webApp.widgetManager.register(MarkerGenericCollection)
 
 	def setQueriesData(self, queryData):
 		self.markerQueries = []
 		self.markerResults = []
+		self.resultsIndex = MarkerResultsIndex([])
+		self._resultsGestureDispatch = None
+		self._queriesGestureDispatch = None
+		self._queriesByPage = None
 		for qd in queryData:
 			if qd["class"] == "Virtual":
 				query = VirtualMarkerQuery(self, qd)
@@ -167,12 +217,16 @@ class MarkerManager(baseObject.ScriptableObject):
 			if q == query:
 				return
 		self.markerQueries.append(query)
+		self._queriesGestureDispatch = None
+		self._queriesByPage = None
 
 	def removeQuery(self, query):
 		self.removeResults(query)
 		for i in range(len(self.markerQueries), 0, -1):
 			if self.markerQueries[i-1] == query:
 				del self.markerQueries[i-1]
+		self._queriesGestureDispatch = None
+		self._queriesByPage = None
 
 	def getQueryByName (self, name):
 		for q in self.markerQueries:
@@ -186,6 +240,64 @@ class MarkerManager(baseObject.ScriptableObject):
 			if not onlyUser or q.user:
 				queries.append(q)
 		return queries
+
+	def getQueriesInContextOrder(self):
+		"""Returns the queries, each one preceded by the query it uses as context."""
+		queries = []
+		visited = set()
+		for query in self.markerQueries:
+			stack = []
+			while query is not None and query not in visited:
+				visited.add(query)
+				stack.append(query)
+				contextName = query.getContext()[0]
+				query = self.getQueryByName(contextName) if contextName else None
+			queries.extend(reversed(stack))
+		return queries
+	
+	def getQueriesByPage(self):
+		"""Returns the queries in context order, grouped by page identifier.
+		
+		Queries not bound to a page, as well as those identifying a page,
+		are grouped under C{None}.
+		"""
+		if self._queriesByPage is None:
+			queriesByPage = {None: []}
+			pageBoundQueries = []
+			for query in self.getQueriesInContextOrder():
+				pageIdentifier = None if query.isPageIdentifier else query.pageIdentifier
+				queriesByPage.setdefault(pageIdentifier, []).append(query)
+				if pageIdentifier is not None:
+					pageBoundQueries.append(query)
+			self._pageBoundQueries = pageBoundQueries
+			self._queriesByPage = queriesByPage
+		return self._queriesByPage
+	
+	def getPageQueries(self, pageIdentifier):
+		"""Returns the queries bound to a page, in context order.
+		
+		Nothing tells which of them apply to an unknown page (C{None}):
+		all the queries bound to a page are then returned.
+		"""
+		queriesByPage = self.getQueriesByPage()
+		if pageIdentifier is None:
+			return self._pageBoundQueries
+		return queriesByPage.get(pageIdentifier, [])
+	
+	def getActiveQueries(self):
+		"""Returns the queries run on the current page, in context order."""
+		return self.getQueriesByPage()[None] + self.getPageQueries(self.pageIdentifier)
+	
+	def resolvePageIdentifier(self):
+		"""Identifies the current page, once the queries not bound to a page are run.
+		
+		The first query identifying a page and having results wins. Otherwise,
+		the web module is asked, see C{WebModule.getPageIdentifier}.
+		"""
+		for query in self.getQueriesByPage()[None]:
+			if query.isPageIdentifier and query.pageIdentifier and query.results:
+				return query.pageIdentifier
+		return self.webApp.getPageIdentifier()
 	
 	def getResults(self):
 		if not self.isReady:
@@ -195,16 +307,14 @@ class MarkerManager(baseObject.ScriptableObject):
 	def getResultsByName(self, name):
 		if not self.isReady:
 			return []
-		results = []
-		for r in self.markerResults:
-			if r.markerQuery.name == name:
-				results.append(r)
-		return results
+		return list(self.resultsIndex.byName.get(name, ()))
 
 	def removeResults(self, query):
 		for i in range(len(self.markerResults), 0, -1):
 			if self.markerResults[i-1].markerQuery== query:
 				del self.markerResults[i-1]
+		self.resultsIndex = MarkerResultsIndex(self.markerResults)
+		self._resultsGestureDispatch = None
 
 	def getActions(self):
 		dic = builtinRuleActions.copy ()
@@ -219,16 +329,89 @@ class MarkerManager(baseObject.ScriptableObject):
 		func = scriptHandler._getObjScript(self, gesture, globalMapScripts)
 		if func:
 			return func
-		pmList = self.getResults() + self.getQueries()
-		for result in pmList:
-			func = scriptHandler._getObjScript(result, gesture, globalMapScripts)
-			if func:
-				return func
+		dispatchList = self.getGestureDispatchList()
+		if self.canDispatchGesture(dispatchList, globalMapScripts):
+			obj = self.dispatchGesture(dispatchList, gesture)
+			if obj is not None:
+				func = scriptHandler._getObjScript(obj, gesture, globalMapScripts)
+				if func:
+					return func
+		else:
+			pmList = self.getResults() + self.getQueries()
+			for result in pmList:
+				func = scriptHandler._getObjScript(result, gesture, globalMapScripts)
+				if func:
+					return func
 		func = scriptHandler._getObjScript(self.defaultMarkerScripts, gesture, globalMapScripts)
 		if func:
 			return func
 		return None
 	
+	def getGestureDispatch(self, objList):
+		"""Maps each gesture identifier bound on the given objects to the first of them.
+		@returns identifier -> (rank, object), and the classes of the objects
+		@rtype tuple
+		"""
+		dispatch = {}
+		for rank, obj in enumerate(objList):
+			for identifier in obj._gestureMap:
+				dispatch.setdefault(identifier, (rank, obj))
+		return dispatch, set(obj.__class__ for obj in objList)
+
+	def getGestureDispatchList(self):
+		"""Returns the gesture dispatch tables of the results, if ready, then of the queries.
+		
+		They are built on demand and discarded as soon as the results or the
+		queries change.
+		"""
+		dispatchList = []
+		if self.isReady:
+			if self._resultsGestureDispatch is None:
+				self._resultsGestureDispatch = self.getGestureDispatch(self.markerResults)
+			dispatchList.append(self._resultsGestureDispatch)
+		if self._queriesGestureDispatch is None:
+			self._queriesGestureDispatch = self.getGestureDispatch(self.markerQueries)
+		dispatchList.append(self._queriesGestureDispatch)
+		return dispatchList
+
+	def canDispatchGesture(self, dispatchList, globalMapScripts):
+		"""Tells whether the gesture dispatch tables apply.
+		
+		They only account for the gestures bound on the objects themselves:
+		if the global gesture maps target the class of any of the objects,
+		each one has to be checked in turn.
+		"""
+		if not globalMapScripts:
+			return True
+		for dispatch, classes in dispatchList:
+			for cls, scriptName in globalMapScripts:
+				for objClass in classes:
+					if issubclass(objClass, cls):
+						return False
+		return True
+
+	def dispatchGesture(self, dispatchList, gesture):
+		"""Returns the first result, or else the first query, binding a gesture.
+		
+		This is the object on which L{getMarkerScript} would find a script
+		when walking the results and then the queries in turn.
+		"""
+		identifiers = getattr(gesture, "normalizedIdentifiers", None)
+		if identifiers is None:
+			identifiers = [
+				inputCore.normalizeGestureIdentifier(identifier)
+				for identifier in gesture.identifiers
+			]
+		for dispatch, classes in dispatchList:
+			found = None
+			for identifier in identifiers:
+				entry = dispatch.get(identifier)
+				if entry is not None and (found is None or entry[0] < found[0]):
+					found = entry
+			if found is not None:
+				return found[1]
+		return None
+
 	def _get_isReady(self):
 		if not self._ready or not self.nodeManager or not self.nodeManager.isReady or self.nodeManager.identifier != self.nodeManagerIdentifier:
 			return False
@@ -246,21 +429,79 @@ class MarkerManager(baseObject.ScriptableObject):
 				self._ready = True
 				return False
 			t = logTimeStart()
+			# Read first: should the tree be replaced while searching, the next update will catch up.
+			identifier = self.nodeManager.identifier
+			previousResults = self.markerResults
+			self.resultMatcher = MarkerResultMatcher(previousResults)
 			self.markerResults = []
-			for query in self.markerQueries:
-				query.resetResults ()
-				
-			for query in self.markerQueries:
-				results = query.getResults(self)
-				self.markerResults += results
-				self.markerResults.sort()
-			self.nodeManagerIdentifier = self.nodeManager.identifier
+			try:
+				self._updateResults()
+				self.resultsIndex = MarkerResultsIndex(self.markerResults)
+			finally:
+				self._resultsGestureDispatch = None
+				matcher = self.resultMatcher
+				self.resultMatcher = None
+			self.addedResults = [r for r in self.markerResults if not matcher.isReused(r)]
+			self.removedResults = [r for r in previousResults if not matcher.isReused(r)]
+			self.movedResults = matcher.moved
+			self.autoActionCandidates.extend(self.addedResults)
+			self.changedQueries.update(
+				result.markerQuery
+				for result in self.addedResults + self.removedResults + self.movedResults
+			)
+			self.nodeManagerIdentifier = identifier
 			self._ready = True
 			#logTime("update marker", t)
 			if self.isReady:
 				webAppScheduler.scheduler.send(eventName="markerManagerUpdated", markerManager=self)
 				return True
 		return False
+
+	def _updateResults(self):
+		"""Runs the queries, filling C{markerResults}.
+		
+		The queries not bound to a page are run first. Queries bound to a
+		page (see C{VirtualMarkerQuery.pageIdentifier}) are then only run if
+		it is the current page, or if the current page is unknown.
+		"""
+		for query in self.markerQueries:
+			query.resetResults ()
+		queriesByPage = self.getQueriesByPage()
+		self._runQueries(queriesByPage[None])
+		pageIdentifier = self.pageIdentifier = self.resolvePageIdentifier()
+		self.webApp.activePageIdentifier = pageIdentifier
+		self._runQueries(self.getPageQueries(pageIdentifier))
+		self.markerResults.sort()
+
+	def _runQueries(self, queries):
+		"""Runs the given queries, in context order, adding to C{markerResults}."""
+		searchQueries = []
+		criteriaList = []
+		limits = []
+		for query in queries:
+			criteria = query.getCriteria()
+			# Queries having a context are searched within its results.
+			if criteria is not None and query.getContext()[0] is None:
+				searchQueries.append(query)
+				criteriaList.append(criteria)
+				limits.append(query.getSearchLimit(widget=query.createWidget))
+		nodeLists = self.nodeManager.searchNodes(criteriaList, limits)
+		for query, nodeList in zip(searchQueries, nodeLists):
+			query.nodeList = nodeList
+			
+		for query in queries:
+			# Widget collections need all the results, even of single-result rules.
+			results = query.getResults(widget=query.createWidget)
+			self.markerResults += results
+
+	def reuseResult(self, query, node):
+		"""Returns the result of the previous update matching a node, if any.
+		
+		Only available while updating.
+		"""
+		if self.resultMatcher is None:
+			return None
+		return self.resultMatcher.match(query, node)
 		
 	def checkPageTitle(self):
 		title = self.getPageTitle()
@@ -275,13 +516,17 @@ class MarkerManager(baseObject.ScriptableObject):
 		with self.lock:
 			if not self.isReady:
 				return
-			i = 0
-			for result in self.markerResults:
-				i += 1
+			# Results kept from an update to the next have already been checked.
+			candidates = self.autoActionCandidates
+			self.autoActionCandidates = []
+			current = set(id(result) for result in self.markerResults)
+			for result in candidates:
+				if id(result) not in current:
+					continue
 				if result.markerQuery.autoAction:
 					controlIdentifier = result.node.controlIdentifier
 					if not controlIdentifier in self.triggeredIdentifiers:
-						self.triggeredIdentifiers.append(controlIdentifier)
+						self.triggeredIdentifiers.add(controlIdentifier)
 						speechOn()
 						speech.cancelSpeech()
 						autoActionName = result.markerQuery.autoAction
@@ -329,20 +574,18 @@ class MarkerManager(baseObject.ScriptableObject):
 		info = html.getCaretInfo()
 		if info is None:
 			return None
-		for r in self.markerResults:
-			if name is not None and r.markerQuery.name != name:
-				continue
-			if r.markerQuery.skip:
-				continue
-			if hasattr(r, "node") and info._startOffset < r.node.offset:
-				return r
+		index = self.resultsIndex
+		results, offsets = index.getNavigable(name)
+		i = bisect.bisect_right(offsets, info._startOffset)
+		if i < len(results):
+			return results[i]
 
 		# if not ffound, return the first result
-		for r in self.markerResults:
-			if not r.markerQuery.skip:
-				playWebAppSound("loop")
-				sleep(0.2)
-				return r
+		results, offsets = index.getNavigable()
+		if results:
+			playWebAppSound("loop")
+			sleep(0.2)
+			return results[0]
 		return None
 
 	def getPreviousResult(self, name=None):
@@ -355,20 +598,18 @@ class MarkerManager(baseObject.ScriptableObject):
 		info = html.getCaretInfo()
 		if info is None:
 			return None
-		for r in reversed(self.markerResults):
-			if name is not None and r.markerQuery.name != name:
-				continue 
-			if r.markerQuery.skip:
-				continue
-			if hasattr(r, "node") and info._startOffset > r.node.offset:
-				return r
+		index = self.resultsIndex
+		results, offsets = index.getNavigable(name)
+		i = bisect.bisect_left(offsets, info._startOffset)
+		if i > 0:
+			return results[i - 1]
 			
 		# if not ffound, return the latest result
-		for r in reversed(self.markerResults):
-			if not r.markerQuery.skip:
-				playWebAppSound("loop")
-				sleep(0.2)
-				return r
+		results, offsets = index.getNavigable()
+		if results:
+			playWebAppSound("loop")
+			sleep(0.2)
+			return results[-1]
 		return None
 
 	def getCurrentResult(self, focusObject=None):
@@ -379,10 +620,10 @@ class MarkerManager(baseObject.ScriptableObject):
 		info = html.getCaretInfo(focusObject=focusObject)
 		if info is None:
 			return None
-		offset = info._startOffset
-		for r in reversed(self.markerResults):
-			if hasattr(r, "node") and offset >= r.node.offset:
-				return r
+		index = self.resultsIndex
+		i = bisect.bisect_right(index.offsets, info._startOffset)
+		if i > 0:
+			return index.results[i - 1]
 		return None
 
 	def focusNextResult(self, name=None):
@@ -437,6 +678,90 @@ class MarkerManager(baseObject.ScriptableObject):
 				}
 
 
+class MarkerResultsIndex(object):
+	"""Offset-sorted views of the results of a L{MarkerManager}, for bisection.
+	
+	Only results bound to a node are indexed.
+	Navigable results are those of the queries not marked as skipped.
+	"""
+	
+	def __init__(self, results):
+		self.results = [r for r in results if hasattr(r, "node")]
+		self.offsets = [r.node.offset for r in self.results]
+		# name -> [result]
+		self.byName = {}
+		for r in results:
+			self.byName.setdefault(r.markerQuery.name, []).append(r)
+		navigable = [r for r in self.results if not r.markerQuery.skip]
+		self.navigable = (navigable, [r.node.offset for r in navigable])
+		# name -> ([result], [offset])
+		self.navigableByName = {}
+		for r in navigable:
+			results, offsets = self.navigableByName.setdefault(r.markerQuery.name, ([], []))
+			results.append(r)
+			offsets.append(r.node.offset)
+	
+	def getNavigable(self, name=None):
+		"""
+		@returns The navigable results, of the given query name if any, and their offsets.
+		@rtype tuple
+		"""
+		if name is None:
+			return self.navigable
+		return self.navigableByName.get(name, ((), ()))
+
+
+class MarkerResultMatcher(object):
+	"""Matches the results of an update to those of the previous one.
+	
+	A previous result of the same query is reused for a node with the same
+	control identifier: preferably at the same offset, otherwise it is
+	reported as moved.
+	Nodes without control identifier are only matched at the same offset.
+	"""
+	
+	def __init__(self, previousResults):
+		# (query, controlIdentifier, offset) -> [result]
+		self.byPosition = {}
+		# (query, controlIdentifier) -> [result]
+		self.byIdentifier = {}
+		for result in previousResults:
+			if not hasattr(result, "node"):
+				continue
+			node = result.node
+			key = (result.markerQuery, node.controlIdentifier)
+			self.byPosition.setdefault(key + (node.offset,), []).append(result)
+			if node.controlIdentifier:
+				self.byIdentifier.setdefault(key, []).append(result)
+		self.reused = set()
+		self.moved = []
+	
+	def _pop(self, results):
+		while results:
+			result = results.pop(0)
+			if id(result) not in self.reused:
+				self.reused.add(id(result))
+				return result
+		return None
+	
+	def match(self, query, node):
+		"""Returns the previous result matching a node, now bound to it, or C{None}."""
+		if node is None:
+			return None
+		key = (query, node.controlIdentifier)
+		result = self._pop(self.byPosition.get(key + (node.offset,)))
+		if result is None and node.controlIdentifier:
+			result = self._pop(self.byIdentifier.get(key))
+			if result is not None:
+				self.moved.append(result)
+		if result is not None:
+			result.node = node
+		return result
+	
+	def isReused(self, result):
+		return id(result) in self.reused
+
+
 class MarkerResult(baseObject.ScriptableObject):
 	
 	def __init__(self, markerQuery):
@@ -596,16 +921,55 @@ class MarkerQuery(baseObject.ScriptableObject):
 		self.markerManager = markerManager
 		self.name = None
 		self.pageIdentifier = None
+		self.isPageIdentifier = False
 		self.user = False
 		self.skip = False
+		self.createWidget = False
 		self.results = None
+		self.nodeList = None
+		self.resultsScope = None
 
 	def resetResults (self):
 		self.results = None
+		self.nodeList = None
+		self.resultsScope = None
 		
-	def getResults(self):
+	def getResults(self, widget=False):
 		return []
 	
+	def getResultsScope(self):
+		"""Returns the subtrees of the results, for the queries using this one as context.
+		
+		It is computed once per update.
+		@rtype L{nodeHandler.SubtreeSet}
+		"""
+		if self.resultsScope is None:
+			self.resultsScope = nodeHandler.SubtreeSet([
+				result.node
+				for result in self.getResults()
+				if getattr(result, "node", None) is not None
+			])
+		return self.resultsScope
+	
+	def getContext(self):
+		"""
+		@returns The name of the context query, or C{None}, and whether it excludes.
+		@rtype tuple
+		"""
+		return None, False
+
+	def getSearchKwargs(self):
+		"""Returns the L{nodeHandler.NodeManager.searchNode} arguments, if any."""
+		return None
+
+	def getCriteria(self):
+		"""Returns the compiled L{nodeHandler.SearchCriteria}, if any."""
+		return None
+
+	def getSearchLimit(self, widget=False):
+		"""Returns the count of search results needed, C{None} for all."""
+		return None
+
 	def getData(self):
 		return None
 	
@@ -627,7 +991,10 @@ class VirtualMarkerQuery(MarkerQuery):
 		dic["class"] = "Virtual"
 		self.dic = dic
 		self.name = dic["name"]
+		# The page this rule is bound to, if any: it is then only run on this page.
+		# If isPageIdentifier is set, this rule identifies this page instead.
 		self.pageIdentifier = dic.get("pageIdentifier", None)
+		self.isPageIdentifier = dic.get("isPageIdentifier", False)
 		self.user= dic.get("user", False)
 		self.gestures= dic.get("gestures", {})
 		gesturesMap = {}
@@ -643,6 +1010,8 @@ class VirtualMarkerQuery(MarkerQuery):
 		self.index = dic.get("index", 0)
 		self.multiple = dic.get("multiple", True)
 		self.createWidget = dic.get("createWidget", False)
+		self._criteria = None
+		self._criteriaKey = None
 
 	def __eq__(self, other):
 		return self.dic == other.dic
@@ -683,13 +1052,57 @@ class VirtualMarkerQuery(MarkerQuery):
 		if notIn != []:
 			dic["notIn_"+argName] = notIn
 
+
+	def getContext(self):
+		context = self.dic.get("context", None)
+		if not context:
+			return None, False
+		# Sliced rather than indexed, as the name may be a single character.
+		if context[1:2] == "!":
+			return context[2:], True
+		return context, False
+
+	def getSearchKwargs(self):
+		dic = self.dic
+		text = dic.get("text", None)
+		if text is not None and text[0:1] == "#":
+			# Results are provided by the webApp script
+			return None
+		kwargs = {}
+		self.addSearchKwargs(kwargs, "text", text)
+		role = dic.get("role", None)
+		if role:
+			kwargs["eq_role"] = role
+		self.addSearchKwargs(kwargs, "tag", dic.get("tag", None))
+		self.addSearchKwargs(kwargs, "id", dic.get("id", None))
+		self.addSearchKwargs(kwargs, "className", dic.get("className", None))
+		self.addSearchKwargs(kwargs, "src", dic.get("src", None))
+		return kwargs
+
+	def getCriteria(self):
+		# The cache is invalidated as soon as a search field of the rule is edited.
+		key = tuple(
+			self.dic.get(name, None)
+			for name in ("text", "role", "tag", "id", "className", "src")
+		)
+		if key != self._criteriaKey:
+			kwargs = self.getSearchKwargs()
+			self._criteria = nodeHandler.SearchCriteria(kwargs) if kwargs is not None else None
+			self._criteriaKey = key
+		return self._criteria
+
+	def getSearchLimit(self, widget=False):
+		if self.index > 0:
+			return self.index
+		if not widget and not self.multiple:
+			return 1
+		return None
 		
 	def getResults(self, widget=False):
 		t = logTimeStart()
 		if self.results is not None:
 			return self.results
 		dic = self.dic
-		kwargs = {}
 		text = dic.get("text", None)
 		if text is not None:
 			if text[0:1] == "#":
@@ -700,14 +1113,9 @@ class VirtualMarkerQuery(MarkerQuery):
 					return func(self)
 				raise
 
-		contextResults = None
-		context = dic.get("context", None)
+		scope = None
+		context, exclude = self.getContext()
 		if context is not None:
-			if context[1] == "!":
-				context = context[2:]
-				exclude = True
-			else:
-				exclude = False
 			contextQuery = self.markerManager.getQueryByName (context)
 			if contextQuery is None:
 				log.info (_("Rule context \"%s\" not found") % context)
@@ -715,32 +1123,35 @@ class VirtualMarkerQuery(MarkerQuery):
 			contextResult = contextQuery.getResults ()
 			if contextResult == []:
 				log.info ("Context %s with no result" % context)
-				return []
-		self.addSearchKwargs(kwargs, "text", text)
-		role = dic.get("role", None)
-		if role:
-			kwargs["eq_role"] = role
-		self.addSearchKwargs(kwargs, "tag", dic.get("tag", None))
-		self.addSearchKwargs(kwargs, "id", dic.get("id", None))
-		self.addSearchKwargs(kwargs, "className", dic.get("className", None))
-		self.addSearchKwargs(kwargs, "src", dic.get("src", None))
+				if not exclude:
+					return []
+			else:
+				scope = contextQuery.getResultsScope ()
 		
 		results = []
-		nodeList = self.markerManager.nodeManager.searchNode(**kwargs)
+		if self.nodeList is not None:
+			nodeList = self.nodeList
+		else:
+			nodeList = self.markerManager.nodeManager.searchCriteria(
+				self.getCriteria(),
+				limit=self.getSearchLimit(widget=widget),
+				scope=scope,
+				excludeScope=exclude
+			)
 		#logTime(u"searchNode %s, %d results" % (self.name, len(nodeList)), t)
 		i = 0
 		for node in nodeList:
 			i += 1
-			r = VirtualMarkerResult(self, node)
+			if self.index > 0 and self.index != i:
+				continue
+			r = self.markerManager.reuseResult(self, node)
+			if r is None:
+				r = VirtualMarkerResult(self, node)
 			if r.markerQuery.isPageTitle:
 				r.text = node.getTreeInterceptorText()
-			if self.index > 0:
-				if self.index == i:
-					results.append(r)
-					break
-				else:
-					continue
 			results.append(r)
+			if self.index > 0:
+				break
 			if not widget and not self.multiple:
 				break
 		self.results = results
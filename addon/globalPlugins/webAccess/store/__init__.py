@@ -51,6 +51,10 @@ class Store(object):
 	def get(self, ref, **kwargs):
 		return None
 	
+	def getPaths(self, ref):
+		"""Returns the paths of the files backing the item with the given ref."""
+		return []
+	
 	def list(self):
 		for ref in self.catalog():
 			item = self.get(ref)
@@ -98,6 +102,10 @@ class DispatchStore(Store):
 			return
 		return self.track(store, item=item)["item"]
 	
+	def getPaths(self, ref):
+		store, kwargs = self.route(ref)
+		return store.getPaths(kwargs["ref"])
+	
 	def getStoreKey(self, store):
 		return store.name
 	
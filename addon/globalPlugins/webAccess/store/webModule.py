@@ -31,6 +31,7 @@ import imp
 import os
 import os.path
 import re
+import threading
 
 import globalVars
 from logHandler import log
@@ -147,6 +148,9 @@ class WebModuleJsonFileStore(Store):
 	def getPath(self, ref):
 		return os.path.join(self.path, "%s.json" % ref)
 	
+	def getPaths(self, ref):
+		return [self.getPath(ref)]
+	
 	def getRef(self, item):
 		ref = item.storeRef
 		if isinstance(ref, tuple):
@@ -268,6 +272,13 @@ class WebModulePythonFileStore(Store):
 	def getPathByRef(self, ref):
 		return os.path.join(self.path, "%s.py" % ref)
 	
+	def getPaths(self, ref):
+		# The data of the module is stored in a JSON file of the same name.
+		return [
+			self.getPathByRef(ref),
+			os.path.join(self.path, "%s.json" % ref),
+			]
+	
 	def getRef(self, item):
 		return item.name
 	
@@ -333,10 +344,170 @@ class WebModuleStore(DispatchStore):
 				yield storeRef
 	
 
+class WebModuleCatalogEntry(object):
+	"""What is needed to tell whether a web module applies, without loading it."""
+	
+	def __init__(self, ref, paths, mtimes, name=None, url=None, windowTitle=None, claimsObjects=False):
+		self.ref = ref
+		self.paths = paths
+		self.mtimes = mtimes
+		self.name = name
+		self.url = url
+		self.windowTitle = windowTitle
+		#: Whether the web module claims objects by class, see C{claimObjectClasses}.
+		self.claimsObjects = claimsObjects
+	
+	def dump(self):
+		return {
+			"ref": list(self.ref) if isinstance(self.ref, tuple) else self.ref,
+			"paths": self.paths,
+			"mtimes": self.mtimes,
+			"name": self.name,
+			"url": self.url,
+			"windowTitle": self.windowTitle,
+			"claimsObjects": self.claimsObjects,
+			}
+	
+	@classmethod
+	def load(cls, data):
+		ref = data["ref"]
+		if isinstance(ref, list):
+			ref = tuple(ref)
+		return cls(
+			ref,
+			data["paths"],
+			data["mtimes"],
+			name=data.get("name"),
+			url=data.get("url"),
+			windowTitle=data.get("windowTitle"),
+			claimsObjects=data.get("claimsObjects", False),
+			)
+
+
+class WebModuleCatalog(object):
+	"""Lists the web modules of a store, loading each one only when needed.
+	
+	The catalog is kept on disk between sessions. A web module is loaded to
+	describe it only when one of its files was added, removed or modified
+	since it was last described. Otherwise, it is loaded when first
+	requested through L{getItem}.
+	"""
+	
+	def __init__(self, store, path):
+		self.store = store
+		#: The path of the file in which the catalog is saved.
+		self.path = path
+		self.entries = None
+		# Loaded web modules, by ref.
+		self.items = {}
+		self.lock = threading.RLock()
+	
+	def getEntries(self, refresh=False):
+		"""
+		@param refresh: Whether to check the files of the store for changes.
+		@returns The entries of the catalog, in the order of the store.
+		@rtype list of L{WebModuleCatalogEntry}
+		"""
+		with self.lock:
+			if self.entries is not None and not refresh:
+				return self.entries
+			previous = self.entries
+			if previous is None:
+				previous = self.read()
+			previousByRef = dict((entry.ref, entry) for entry in previous)
+			entries = []
+			changed = False
+			for ref in self.store.catalog():
+				paths = self.store.getPaths(ref)
+				mtimes = [self.getModificationTime(path) for path in paths]
+				entry = previousByRef.get(ref)
+				if entry is None or entry.paths != paths or entry.mtimes != mtimes:
+					self.items.pop(ref, None)
+					entry = self.describe(ref, paths, mtimes)
+					if entry is None:
+						continue
+					changed = True
+				entries.append(entry)
+			refs = set(entry.ref for entry in entries)
+			for ref in self.items.keys():
+				if ref not in refs:
+					del self.items[ref]
+			if changed or len(entries) != len(previous):
+				self.write(entries)
+			self.entries = entries
+			return entries
+	
+	def getItem(self, entry):
+		"""Returns the web module described by the given entry, loading it if needed."""
+		with self.lock:
+			item = self.items.get(entry.ref)
+			if item is None:
+				item = self.store.get(entry.ref)
+				if item is None:
+					log.warn("No item retrieved for ref: %s" % (entry.ref,))
+					return None
+				self.items[entry.ref] = item
+			return item
+	
+	def describe(self, ref, paths, mtimes):
+		item = self.store.get(ref)
+		if item is None:
+			log.warn("No item retrieved for ref: %s" % (ref,))
+			return None
+		self.items[ref] = item
+		url = item.url
+		if isinstance(url, basestring):
+			url = [url]
+		return WebModuleCatalogEntry(
+			ref,
+			paths,
+			mtimes,
+			name=item.name,
+			url=list(url) if url else None,
+			windowTitle=item.windowTitle,
+			claimsObjects=hasattr(item, "claimObjectClasses"),
+			)
+	
+	def getModificationTime(self, path):
+		try:
+			return os.path.getmtime(path)
+		except OSError:
+			return None
+	
+	def read(self):
+		if not os.path.isfile(self.path):
+			return []
+		try:
+			with open(self.path, "rb") as f:
+				data = json.load(f)
+			return [WebModuleCatalogEntry.load(item) for item in data["WebModules"]]
+		except:
+			log.exception("Failed to read the web modules catalog: %s" % self.path)
+			return []
+	
+	def write(self, entries):
+		data = {"WebModules": [entry.dump() for entry in entries]}
+		try:
+			with open(self.path, "wb") as f:
+				json.dump(data, f, indent=4)
+		except:
+			log.exception("Failed to write the web modules catalog: %s" % self.path)
+
+
 _instance = None
+_catalog = None
 
 def getInstance():
 	global _instance
 	if _instance is None:
 		_instance = WebModuleStore()
 	return _instance
+
+def getCatalog():
+	global _catalog
+	if _catalog is None:
+		_catalog = WebModuleCatalog(
+			getInstance(),
+			os.path.join(globalVars.appArgs.configPath, "webModulesCatalog.json")
+			)
+	return _catalog
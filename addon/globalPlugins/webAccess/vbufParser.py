@@ -0,0 +1,160 @@
+# globalPlugins/webAccess/vbufParser.py
+# -*- coding: utf-8 -*-
+
+# This file is part of Web Access for NVDA.
+# Copyright (C) 2015-2018 Accessolutions (http://accessolutions.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# See the file COPYING.txt at the root of this distribution for more details.
+
+"""Fast parser for the XML content of NVDA virtual buffers.
+
+This is a stripped-down equivalent of C{XMLFormatting.XMLTextParser} as used
+by C{VirtualBufferTextInfo.getTextWithFields}.
+It builds the field list consumed by L{nodeHandler.NodeManager} in a single
+expat pass: format fields are dropped and control fields only keep the
+attributes used by the node tree and the rule engine.
+
+The field list is still materialized rather than streamed into the tree:
+incremental updates compare it with the list of the previous update to
+find the nodes to reuse.
+
+NVDA modules are only imported by L{getTextWithFields}, so that the parser
+itself can be run outside of NVDA, on captured dumps.
+"""
+
+__version__ = "2018.03.14"
+
+__author__ = u"Frédéric Brugnot <f.brugnot@accessolutions.fr>"
+
+
+from xml.parsers import expat
+
+
+#: Control field attributes kept on each node.
+CONTROL_ATTRIBUTES = frozenset((
+	"role",
+	"name",
+	"level",
+	"controlIdentifier_docHandle",
+	"controlIdentifier_ID",
+	"IAccessible2::attribute_tag",
+	"IHTMLDOMNode::nodeName",
+	"IAccessible2::attribute_id",
+	"HTMLAttrib::id",
+	"IAccessible2::attribute_class",
+	"HTMLAttrib::class",
+	"HTMLAttrib::className",
+	"IAccessible2::attribute_src",
+	"HTMLAttrib::src",
+))
+
+
+class VBufFieldParser(object):
+	"""Turns virtual buffer XML into a list of text strings and control fields.
+
+	Text of consecutive format runs is kept in separate strings, as it would
+	be in the list returned by C{getTextWithFields}.
+	"""
+
+	def __init__(self, fieldCommand, controlField, normalizeControlField=None):
+		"""
+		@param fieldCommand: The class of the field commands, typically C{textInfos.FieldCommand}.
+		@param controlField: The class of the control fields, typically C{textInfos.ControlField}.
+		@param normalizeControlField: Called on each control field before its
+			attributes are filtered, typically the C{_normalizeControlField}
+			method of the virtual buffer TextInfo.
+		@type normalizeControlField: callable
+		"""
+		self.fieldCommand = fieldCommand
+		self.controlField = controlField
+		# Shared by all the control ends of the parsed field list.
+		self.controlEnd = fieldCommand("controlEnd", None)
+		self.normalizeControlField = normalizeControlField
+		self.fields = []
+		# Character data of the current text run, as expat may split it.
+		self.textChunks = []
+		parser = self.parser = expat.ParserCreate("utf-8")
+		parser.StartElementHandler = self._startElementHandler
+		parser.EndElementHandler = self._endElementHandler
+		parser.CharacterDataHandler = self._characterDataHandler
+
+	def _flushText(self):
+		if self.textChunks:
+			self.fields.append(u"".join(self.textChunks))
+			self.textChunks = []
+
+	def _startElementHandler(self, tagName, attrs):
+		if tagName == "unich":
+			data = attrs.get("value", None)
+			if data is not None:
+				try:
+					data = unichr(int(data))
+				except ValueError:
+					data = u"\ufffd"
+				self.textChunks.append(data)
+			return
+		self._flushText()
+		if tagName == "control":
+			field = self.controlField(attrs)
+			if self.normalizeControlField is not None:
+				field = self.normalizeControlField(field)
+			kept = self.controlField()
+			for key in CONTROL_ATTRIBUTES:
+				if key in field:
+					kept[key] = field[key]
+			self.fields.append(self.fieldCommand("controlStart", kept))
+		elif tagName != "text":
+			raise ValueError("Unknown tag name: %s" % tagName)
+
+	def _endElementHandler(self, tagName):
+		if tagName == "control":
+			self._flushText()
+			self.fields.append(self.controlEnd)
+		elif tagName not in ("text", "unich"):
+			raise ValueError("Unknown tag name: %s" % tagName)
+
+	def _characterDataHandler(self, data):
+		self.textChunks.append(data)
+
+	def parse(self, xml):
+		"""
+		@param xml: The virtual buffer content, as returned by C{VBuf_getTextInRange}.
+		@type xml: unicode
+		@returns The fields, in the same order as C{getTextWithFields}.
+		@rtype list
+		"""
+		self.parser.Parse(xml.encode("utf-8"), True)
+		self._flushText()
+		return self.fields
+
+
+def getTextWithFields(info):
+	"""Fast equivalent of C{info.getTextWithFields()} for virtual buffer TextInfos."""
+	import NVDAHelper
+	import textInfos
+	start = info._startOffset
+	end = info._endOffset
+	if start == end:
+		return []
+	xml = NVDAHelper.VBuf_getTextInRange(info.obj.VBufHandle, start, end, True)
+	if not xml:
+		return []
+	parser = VBufFieldParser(
+		textInfos.FieldCommand,
+		textInfos.ControlField,
+		normalizeControlField=getattr(info, "_normalizeControlField", None)
+	)
+	return parser.parse(xml)
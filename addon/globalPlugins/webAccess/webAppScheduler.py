@@ -24,9 +24,11 @@ __version__ = "2016.11.30"
 __author__ = u"Frédéric Brugnot <f.brugnot@accessolutions.fr>"
 
 
+import heapq
 import wx
 import Queue
 import threading
+import time
 
 import api
 import traceback
@@ -36,6 +38,137 @@ import ui
 from .webAppLib import *
 
 
+#: Event priorities, lowest first.
+PRIORITY_USER = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+#: Events triggered by the user, handled before any pending refresh.
+#: Events not listed here have normal priority.
+EVENT_PRIORITIES = {
+	"stop": PRIORITY_USER,
+	"webApp": PRIORITY_USER,
+	"gainFocus": PRIORITY_USER,
+	"configurationChanged": PRIORITY_USER,
+	"updateNodeManager": PRIORITY_BACKGROUND,
+	"checkWebAppManager": PRIORITY_BACKGROUND,
+}
+
+
+#: Bounds of the delay, in seconds, before polling for changes when idle.
+POLL_INTERVAL_MIN = 0.5
+POLL_INTERVAL_MAX = 5.0
+
+#: Growth factor of the polling delay while the document does not change.
+POLL_INTERVAL_GROWTH = 1.5
+
+
+def getEventKey(event):
+	"""Returns the key under which a pending event absorbs its duplicates.
+	
+	@returns The key, or C{None} if the event should never be coalesced.
+	"""
+	eventName = event["eventName"]
+	if eventName == "updateNodeManager":
+		return (eventName, id(event.get("treeInterceptor")))
+	if eventName == "checkWebAppManager":
+		return eventName
+	return None
+
+
+class EventQueue(object):
+	"""A priority queue that coalesces duplicate pending events.
+	
+	Events of the same priority are delivered in the order they were sent.
+	An event sent while an event with the same key (see L{getEventKey})
+	is pending replaces the arguments of the pending one instead of being
+	queued again.
+	The queue keeps counters of its depth and of the latency of the events,
+	that is the time spent waiting in the queue.
+	"""
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.notEmpty = threading.Condition(self.lock)
+		# [priority, sequence, time sent, event]
+		self.heap = []
+		self.pendingByKey = {}
+		self.sequence = 0
+		self.sentCount = 0
+		self.coalescedCount = 0
+		self.deliveredCount = 0
+		self.maxDepth = 0
+		self.totalLatency = 0.0
+		self.maxLatency = 0.0
+	
+	def qsize(self):
+		with self.lock:
+			return len(self.heap)
+	
+	def put(self, event):
+		with self.lock:
+			self.sentCount += 1
+			key = getEventKey(event)
+			if key is not None:
+				entry = self.pendingByKey.get(key)
+				if entry is not None:
+					entry[3].update(event)
+					self.coalescedCount += 1
+					return
+			priority = EVENT_PRIORITIES.get(event["eventName"], PRIORITY_NORMAL)
+			entry = [priority, self.sequence, time.time(), event]
+			self.sequence += 1
+			heapq.heappush(self.heap, entry)
+			if key is not None:
+				self.pendingByKey[key] = entry
+			self.maxDepth = max(self.maxDepth, len(self.heap))
+			self.notEmpty.notify()
+	
+	def get(self, block=True, timeout=None):
+		"""Same as C{Queue.Queue.get}.
+		@raise Queue.Empty: If no event is pending before the timeout.
+		"""
+		with self.lock:
+			if block:
+				if timeout is None:
+					while not self.heap:
+						self.notEmpty.wait()
+				else:
+					deadline = time.time() + timeout
+					while not self.heap:
+						remaining = deadline - time.time()
+						if remaining <= 0:
+							break
+						self.notEmpty.wait(remaining)
+			if not self.heap:
+				raise Queue.Empty
+			priority, sequence, sentTime, event = heapq.heappop(self.heap)
+			key = getEventKey(event)
+			if key is not None:
+				del self.pendingByKey[key]
+			latency = time.time() - sentTime
+			self.deliveredCount += 1
+			self.totalLatency += latency
+			self.maxLatency = max(self.maxLatency, latency)
+			return event
+	
+	def getStats(self):
+		"""
+		@returns The counters of this queue.
+		@rtype dict
+		"""
+		with self.lock:
+			return {
+				"depth": len(self.heap),
+				"maxDepth": self.maxDepth,
+				"sent": self.sentCount,
+				"coalesced": self.coalescedCount,
+				"delivered": self.deliveredCount,
+				"averageLatency": self.totalLatency / self.deliveredCount if self.deliveredCount else 0.0,
+				"maxLatency": self.maxLatency,
+			}
+
+
 def displayTraceBack (msg):
 	stack = ""
 	for func in traceback.extract_stack()[:-1]:
@@ -45,10 +178,16 @@ def displayTraceBack (msg):
 class WebAppScheduler(threading.Thread):
 	
 	lastTreeInterceptor = None
-	def __init__(self, onNodeManagerUpdated):
+	def __init__(self, onNodeManagerUpdated, maxPollInterval=POLL_INTERVAL_MAX):
+		"""
+		@param maxPollInterval: The ceiling, in seconds, of the delay before
+			polling for changes while the document does not change.
+		"""
 		super(WebAppScheduler,self).__init__()
 		self.daemon = True
-		self.queue = Queue.Queue()
+		self.queue = EventQueue()
+		self.maxPollInterval = maxPollInterval
+		self.pollInterval = POLL_INTERVAL_MIN
 		global scheduler
 		scheduler = self
 		self.onNodeManagerUpdated = onNodeManagerUpdated
@@ -57,8 +196,8 @@ class WebAppScheduler(threading.Thread):
 		self.stop = False
 		while not self.stop:
 			try:
-				event = self.queue.get(True, 0.5)
-			except:
+				event = self.queue.get(True, self.pollInterval)
+			except Queue.Empty:
 				event = {"eventName":"timeout"}
 			if isinstance (event, dict):
 				eventName = event["eventName"]
@@ -83,8 +222,20 @@ class WebAppScheduler(threading.Thread):
 		self.stop = True 
 		
 	def event_timeout (self):
-		self.send (eventName="updateNodeManager", treeInterceptor=api.getFocusObject().treeInterceptor )
+		from . import supportWebApp
+		focus = api.getFocusObject()
+		if not supportWebApp(focus):
+			# No need to poll while the focus is outside of the web browsers.
+			return
+		self.send (eventName="updateNodeManager", treeInterceptor=focus.treeInterceptor, poll=True)
 		self.send (eventName="checkWebAppManager")
+
+	def onPollResult (self, changed):
+		"""Adapts the polling delay: shortened after a change, lengthened while idle."""
+		if changed:
+			self.pollInterval = POLL_INTERVAL_MIN
+		else:
+			self.pollInterval = min(self.pollInterval * POLL_INTERVAL_GROWTH, self.maxPollInterval)
 				 
 	def fakeNext(self = None):
 		return True
@@ -129,14 +280,28 @@ class WebAppScheduler(threading.Thread):
 				if nodeManager:
 					webApp.markerManager.update (nodeManager)
 		
-	def event_updateNodeManager(self, treeInterceptor, webApp=None):
+	def event_updateNodeManager(self, treeInterceptor, webApp=None, poll=False):
+		"""
+		@param poll: Whether this update is a periodic poll, which then
+			adapts the polling delay (see L{onPollResult}).
+		"""
 		if treeInterceptor is None:
 			return
-		if hasattr (treeInterceptor, "nodeManager"):
-			treeInterceptor.nodeManager.update ()
+		from . import nodeHandler
+		nodeManager = nodeHandler.registry.get (treeInterceptor)
+		if nodeManager is not None:
+			changed = nodeManager.update ()
+			if changed:
+				from . import checkDocumentWebApp
+				checkDocumentWebApp (treeInterceptor)
+			if poll:
+				self.onPollResult (changed)
 		else:
-			from . import nodeHandler
-			treeInterceptor.nodeManager = nodeHandler.NodeManager (treeInterceptor, self.onNodeMoveto, inSeparateThread=True)
+			nodeManager = nodeHandler.NodeManager (treeInterceptor, self.onNodeMoveto, inSeparateThread=True)
+			nodeHandler.registry.add (treeInterceptor, nodeManager)
+			if poll:
+				self.onPollResult (True)
+		nodeHandler.registry.purge ()
 		if webApp:
 			webApp.treeInterceptor = treeInterceptor
 
@@ -28,6 +28,7 @@ __version__ = "2016.12.20"
 __author__ = "Julien Cochuyt <j.cochuyt@accessolutions.fr>"
 
 
+import collections
 import os
 import wx
 
@@ -43,7 +44,7 @@ from ..store import MalformedRefError
 
 def create(webModule, force=False):
 	store.getInstance().create(webModule, force=force)
-	getWebModules(refresh=True)
+	refresh()
 
 def delete(webModule, prompt=True):
 	if prompt:
@@ -51,7 +52,7 @@ def delete(webModule, prompt=True):
 		if not webModulesManager.promptDelete(webModule):
 			return False
 	store.getInstance().delete(webModule)
-	getWebModules(refresh=True)
+	refresh()
 	return True
 
 def getCurrentWebModule():
@@ -59,14 +60,63 @@ def getCurrentWebModule():
 	pass	
 
 def getWebModules(refresh=False):
-	global _webModuleCache
-	if refresh or "_webModuleCache" not in globals():
-		_webModuleCache = list(store.getInstance().list())
-	return _webModuleCache
+	"""Returns all the web modules, loading those not loaded yet.
+	
+	Prefer L{getWebModuleFromUrl}, L{getWebModuleFromWindowTitle} or
+	L{getWebModuleByName}, which only load the web module they return.
+	"""
+	catalog = store.getCatalog()
+	webModules = []
+	for entry in getWebModuleIndex(refresh=refresh).entries:
+		webModule = catalog.getItem(entry)
+		if webModule is not None:
+			webModules.append(webModule)
+	return webModules
+
+def getWebModuleIndex(refresh=False):
+	global _webModuleIndex
+	if refresh or "_webModuleIndex" not in globals():
+		_webModuleIndex = WebModuleIndex(store.getCatalog().getEntries(refresh=refresh))
+	return _webModuleIndex
+
+def refresh():
+	"""Takes into account changes to the web module files."""
+	getWebModuleIndex(refresh=True)
+	# Open documents may be bound to a web module that changed.
+	from .. import documentWebApps
+	documentWebApps.clear()
+
+def getWebModule(entry):
+	if entry is None:
+		return None
+	return store.getCatalog().getItem(entry)
+
+def getWebModuleByName(name):
+	for entry in getWebModuleIndex().entries:
+		if entry.name == name:
+			return getWebModule(entry)
+	return None
+
+def getWebModuleFromUrl(url):
+	"""Returns the web module with the longest URL fragment found in a URL."""
+	return getWebModule(getWebModuleIndex().getFromUrl(url))
+
+def getWebModuleFromWindowTitle(windowTitle):
+	"""Returns the first web module whose window title is found in a window title."""
+	return getWebModule(getWebModuleIndex().getFromWindowTitle(windowTitle))
+
+def getClaimingWebModules():
+	"""Returns the web modules which may claim objects that have no URL."""
+	webModules = []
+	for entry in getWebModuleIndex().claimingEntries:
+		webModule = getWebModule(entry)
+		if webModule is not None:
+			webModules.append(webModule)
+	return webModules
 
 def update(webModule, force=False):
 	store.getInstance().update(webModule, force=force)
-	getWebModules(refresh=True)
+	refresh()
 
 def showCreator(context):
 	showEditor(context, new=True)
@@ -120,7 +170,7 @@ def showEditor(context, new=False):
 						)
 				finally:
 					if not new:
-						getWebModules(refresh=True)
+						refresh()
 		else:
 			keepShowing = False
 			if new:
@@ -129,4 +179,136 @@ def showEditor(context, new=False):
 	
 def showManager(context):
 	from ..gui import webModulesManager
-	webModulesManager.show(context)
\ No newline at end of file
+	webModulesManager.show(context)
+
+
+class SubstringMatcher(object):
+	"""Finds which of a set of keys occur in a text, in a single pass.
+	
+	This is an Aho-Corasick automaton: the cost of a search depends on the
+	length of the text and on the number of matches, not on the number of
+	keys.
+	"""
+	
+	def __init__(self):
+		# For each state: transitions, failure state, values of the keys ending there.
+		self.transitions = [{}]
+		self.failures = [0]
+		self.outputs = [[]]
+	
+	def add(self, key, value):
+		state = 0
+		for char in key:
+			nextState = self.transitions[state].get(char)
+			if nextState is None:
+				nextState = len(self.transitions)
+				self.transitions.append({})
+				self.failures.append(0)
+				self.outputs.append([])
+				self.transitions[state][char] = nextState
+			state = nextState
+		self.outputs[state].append(value)
+	
+	def build(self):
+		"""Computes the failure links. To be called once all the keys are added."""
+		queue = collections.deque(self.transitions[0].values())
+		while queue:
+			state = queue.popleft()
+			for char, nextState in self.transitions[state].iteritems():
+				queue.append(nextState)
+				failure = self.failures[state]
+				while failure and char not in self.transitions[failure]:
+					failure = self.failures[failure]
+				failure = self.transitions[failure].get(char, 0)
+				if failure == nextState:
+					failure = 0
+				self.failures[nextState] = failure
+				self.outputs[nextState].extend(self.outputs[failure])
+	
+	def iterMatches(self, text):
+		"""Yields the values of the keys found in the text, once per occurrence."""
+		transitions = self.transitions
+		failures = self.failures
+		outputs = self.outputs
+		state = 0
+		for char in text:
+			while state and char not in transitions[state]:
+				state = failures[state]
+			state = transitions[state].get(char, 0)
+			for value in outputs[state]:
+				yield value
+
+
+class WebModuleIndex(object):
+	"""Resolves the web module matching a URL or a window title.
+	
+	Lookups give the same result as testing the URL fragments or the window
+	title of each web module in turn, but scan the text only once.
+	Results are cached per URL and per window title.
+	The index is built from the entries of the web modules catalog, so that
+	web modules need not be loaded to be matched.
+	"""
+	
+	#: Maximum number of entries of each lookup cache.
+	CACHE_MAX_SIZE = 256
+	
+	def __init__(self, entries):
+		self.entries = entries
+		self.urlMatcher = SubstringMatcher()
+		self.windowTitleMatcher = SubstringMatcher()
+		#: The web modules which may claim objects that have no URL.
+		self.claimingEntries = []
+		for rank, entry in enumerate(entries):
+			urls = entry.url
+			if urls is None:
+				urls = []
+			elif isinstance(urls, basestring):
+				urls = [urls]
+			for url in urls:
+				if isinstance(url, basestring) and url:
+					self.urlMatcher.add(url, (len(url), -rank, entry))
+			windowTitle = entry.windowTitle
+			if isinstance(windowTitle, basestring) and windowTitle:
+				self.windowTitleMatcher.add(windowTitle, (rank, entry))
+			if entry.claimsObjects:
+				self.claimingEntries.append(entry)
+		self.urlMatcher.build()
+		self.windowTitleMatcher.build()
+		self.urlCache = {}
+		self.windowTitleCache = {}
+	
+	def _cache(self, cache, key, value):
+		if len(cache) >= self.CACHE_MAX_SIZE:
+			cache.clear()
+		cache[key] = value
+	
+	def getFromUrl(self, url):
+		if not url:
+			return None
+		try:
+			return self.urlCache[url]
+		except KeyError:
+			pass
+		# The longest fragment wins, then the first web module.
+		best = None
+		for match in self.urlMatcher.iterMatches(url):
+			if best is None or match[:2] > best[:2]:
+				best = match
+		webModule = best[2] if best else None
+		self._cache(self.urlCache, url, webModule)
+		return webModule
+	
+	def getFromWindowTitle(self, windowTitle):
+		if not windowTitle:
+			return None
+		try:
+			return self.windowTitleCache[windowTitle]
+		except KeyError:
+			pass
+		best = None
+		for match in self.windowTitleMatcher.iterMatches(windowTitle):
+			if best is None or match[0] < best[0]:
+				best = match
+		webModule = best[1] if best else None
+		self._cache(self.windowTitleCache, windowTitle, webModule)
+		return webModule
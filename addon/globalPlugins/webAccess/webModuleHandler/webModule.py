@@ -139,6 +139,15 @@ class WebModule(baseObject.ScriptableObject):
 			title = api.getFocusObject().windowText
 		return title
 
+	def getPageIdentifier(self):
+		"""Identifies the current page when no rule does, typically from its URL or title.
+		
+		Only the rules bound to the returned page, along with those bound to
+		no page, are then run.
+		@returns The page identifier, or C{None} if unknown.
+		"""
+		return None
+
 	def getPresentationConfig(self):
 		return {
 			'braille.stripBlanks': True,
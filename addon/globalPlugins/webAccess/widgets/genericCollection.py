@@ -50,6 +50,8 @@ class GenericCollection(WebAppWidget):
 	name = None
 	brailleName = None
 	_collection = []
+	# The collection and the offsets of its nodes, see __contains__.
+	_collectionOffsets = None
 	activeNode = None
 	itemIndex = 0
 
@@ -75,9 +77,13 @@ class GenericCollection(WebAppWidget):
 	def __contains__(self, data):
 		if self._useVirtualBuffer:
 			# log.info("Searching for node offset %d in a %d length collection" %(data.offset, len(self._collection)))
-			for x in self._collection:
-				if x == data:
-					return True
+			if data is None:
+				return False
+			# Nodes compare by offset.
+			collection = self._collection
+			if self._collectionOffsets is None or self._collectionOffsets[0] is not collection:
+				self._collectionOffsets = (collection, frozenset(x.offset for x in collection))
+			return data.offset in self._collectionOffsets[1]
 		else:
 			log.info("operator __contains__ not supported for non-virtualbuffer wcgd!ts")
 			return False
@@ -0,0 +1,145 @@
+# tools/vbufParserBenchmark.py
+# -*- coding: utf-8 -*-
+
+# This file is part of Web Access for NVDA.
+# Copyright (C) 2015-2018 Accessolutions (http://accessolutions.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# See the file COPYING.txt at the root of this distribution for more details.
+
+"""Runs the virtual buffer XML parser on captured dumps, outside of NVDA.
+
+Usage: python vbufParserBenchmark.py [--repeat N] [--synthetic NODES] [dump.xml ...]
+
+Without dump arguments, the dumps of the vbufDumps directory are used.
+With C{--synthetic}, a generated page of the given count of controls is
+parsed as well.
+
+To capture a dump, run the following in the NVDA Python console while the
+focus is in a web page::
+
+	import NVDAHelper
+	ti = focus.treeInterceptor
+	end = ti.makeTextInfo("all")._endOffset
+	xml = NVDAHelper.VBuf_getTextInRange(ti.VBufHandle, 0, end, True)
+	open("dump.xml", "wb").write(xml.encode("utf-8"))
+"""
+
+from __future__ import print_function
+
+import glob
+import imp
+import os
+import sys
+import time
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DUMPS_DIR = os.path.join(BASE_DIR, "vbufDumps")
+
+PARSER_PATH = os.path.join(
+	BASE_DIR, "..", "addon", "globalPlugins", "webAccess", "vbufParser.py"
+)
+
+
+class FieldCommand(object):
+	"""Stand-in for C{textInfos.FieldCommand}."""
+
+	def __init__(self, command, field):
+		self.command = command
+		self.field = field
+
+
+class ControlField(dict):
+	"""Stand-in for C{textInfos.ControlField}."""
+
+
+def loadParser():
+	# Loaded by path, as the webAccess package itself requires NVDA.
+	return imp.load_source("vbufParser", PARSER_PATH)
+
+
+def makeSyntheticDump(count):
+	parts = [u'<control controlIdentifier_docHandle="1" controlIdentifier_ID="0" role="52" IAccessible2::attribute_tag="body">']
+	for index in range(1, count + 1):
+		parts.append(
+			u'<control controlIdentifier_docHandle="1" controlIdentifier_ID="%d" role="47"'
+			u' IAccessible2::attribute_tag="div" IAccessible2::attribute_class="item c%d"'
+			u' states="16384" font-family="Arial">'
+			u'<text language="en" font-size="10pt">Item %d</text>'
+			u'<text language="en" font-weight="bold"> &amp; more</text></control>'
+			% (index, index % 7, index)
+		)
+	parts.append(u"</control>")
+	return u"".join(parts)
+
+
+def summarize(fields):
+	controls = 0
+	texts = []
+	depth = 0
+	for field in fields:
+		if isinstance(field, unicode):
+			texts.append(field)
+		elif field.command == "controlStart":
+			controls += 1
+			depth += 1
+		elif field.command == "controlEnd":
+			depth -= 1
+	if depth != 0:
+		raise ValueError("Unbalanced controls: %d" % depth)
+	return controls, u"".join(texts)
+
+
+def run(vbufParser, name, xml, repeat):
+	best = None
+	for iteration in range(repeat):
+		start = time.time()
+		fields = vbufParser.VBufFieldParser(FieldCommand, ControlField).parse(xml)
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	controls, text = summarize(fields)
+	print(
+		"%s: %d characters of XML, %d fields, %d controls, %d characters of text, best of %d: %.2f ms"
+		% (name, len(xml), len(fields), controls, len(text), repeat, best * 1000)
+	)
+
+
+def main(args):
+	repeat = 5
+	synthetic = None
+	paths = []
+	while args:
+		arg = args.pop(0)
+		if arg == "--repeat":
+			repeat = int(args.pop(0))
+		elif arg == "--synthetic":
+			synthetic = int(args.pop(0))
+		else:
+			paths.append(arg)
+	if not paths:
+		paths = sorted(glob.glob(os.path.join(DUMPS_DIR, "*.xml")))
+	vbufParser = loadParser()
+	for path in paths:
+		with open(path, "rb") as f:
+			xml = f.read().decode("utf-8")
+		run(vbufParser, os.path.basename(path), xml, repeat)
+	if synthetic:
+		run(vbufParser, "synthetic(%d)" % synthetic, makeSyntheticDump(synthetic), repeat)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])